@@ -0,0 +1,422 @@
+"""Offline benchmark of the conversation pipeline.
+
+Starts a local mock of both chat-completions endpoints in a subprocess (so
+its CPU and memory do not pollute the numbers), points ConversationEngine at
+it and runs a matrix of concurrency x turns x delay settings::
+
+    python -m defi_ai_bench run --concurrency 1,4,16 --turns 2,4 --delay 0,0-0.5 \\
+        --latency lognormal:0.3:0.5 --errors 429=0.02,500=0.01,timeout=0.01 \\
+        --output bench.json [--compare previous.json]
+
+Every cell runs in a fresh worker process, so its ``peak_rss_mb`` is the
+peak of that cell alone rather than of all cells run so far.
+
+The mock alone can be started with ``python -m defi_ai_bench mock --port N``;
+it also serves ``/ip`` as an offline target for proxy checks.
+
+``python -m defi_ai_bench prompts --size-mb 20`` measures load time and
+memory of the prompt library against reading the file into a list.
+"""
+
+import argparse
+import asyncio
+import concurrent.futures
+import json
+import math
+import multiprocessing
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from defi_ai_core import Account, parse_delay_range
+from defi_ai_engine import ConversationEngine
+from defi_ai_prompts import MAX_PROMPT_CHARS, PromptLibrary
+from defi_ai_stats import LatencyHistogram
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+MOCK_PATHS = ("/v1/chat/completions", "/api/v1/chat/completions")
+
+# =============================
+# Mock server
+# =============================
+
+def parse_latency(spec):
+    """Sampler in seconds for a spec like fixed:S, uniform:LO:HI or lognormal:MEDIAN:SIGMA."""
+    kind, *args = spec.split(":")
+    values = [float(a) for a in args]
+    if kind == "fixed":
+        return lambda: values[0]
+    if kind == "uniform":
+        return lambda: random.uniform(values[0], values[1])
+    if kind == "lognormal":
+        mu = math.log(values[0])
+        return lambda: random.lognormvariate(mu, values[1])
+    raise ValueError(f"unknown latency distribution: {spec}")
+
+
+def parse_errors(spec):
+    """Parse 429=0.02,500=0.01,timeout=0.01 into [(kind, probability), ...]."""
+    errors = []
+    for item in filter(None, (spec or "").split(",")):
+        kind, probability = item.split("=")
+        errors.append((kind.strip(), float(probability)))
+    return errors
+
+
+class MockProvider:
+    """OpenAI-compatible /chat/completions with injected latency and errors."""
+
+    def __init__(self, latency, errors, response_words, token_delay, hang_seconds):
+        self.latency = latency
+        self.errors = errors
+        self.response_words = response_words
+        self.token_delay = token_delay
+        self.hang_seconds = hang_seconds
+
+    def _pick_error(self):
+        roll = random.random()
+        for kind, probability in self.errors:
+            if roll < probability:
+                return kind
+            roll -= probability
+        return None
+
+    async def head(self, request):
+        from aiohttp import web
+
+        return web.Response()
+
+    async def ip(self, request):
+        """httpbin-style /ip, the local target for proxy checks."""
+        from aiohttp import web
+
+        return web.json_response({"origin": request.remote})
+
+    async def chat(self, request):
+        from aiohttp import web
+
+        body = await request.json()
+        error = self._pick_error()
+        if error == "timeout":
+            await asyncio.sleep(self.hang_seconds)
+            return web.Response(status=504)
+        await asyncio.sleep(self.latency())
+        if error:
+            status = int(error)
+            headers = {"Retry-After": "1"} if status == 429 else {}
+            return web.json_response({"error": {"message": f"injected {status}"}}, status=status, headers=headers)
+
+        words = [f"слово{i}" for i in range(self.response_words)]
+        prompt_tokens = sum(len(m.get("content", "")) for m in body.get("messages", [])) // 4
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": len(words),
+                 "total_tokens": prompt_tokens + len(words)}
+        if not body.get("stream"):
+            return web.json_response({
+                "choices": [{"message": {"role": "assistant", "content": " ".join(words)}}],
+                "usage": usage,
+            })
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        for word in words:
+            chunk = {"choices": [{"delta": {"content": word + " "}}]}
+            await response.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+            if self.token_delay:
+                await asyncio.sleep(self.token_delay)
+        await response.write(f"data: {json.dumps({'choices': [], 'usage': usage})}\n\n".encode("utf-8"))
+        await response.write(b"data: [DONE]\n\n")
+        return response
+
+
+def serve_mock(args):
+    from aiohttp import web
+
+    provider = MockProvider(parse_latency(args.latency), parse_errors(args.errors),
+                            args.response_words, args.token_delay, args.hang_seconds)
+    app = web.Application()
+    for path in MOCK_PATHS:
+        app.router.add_post(path, provider.chat)
+    app.router.add_route("HEAD", "/", provider.head)
+    app.router.add_get("/ip", provider.ip)
+    web.run_app(app, host="127.0.0.1", port=args.port, print=None)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_mock(args):
+    port = free_port()
+    command = [sys.executable, "-m", "defi_ai_bench", "mock", "--port", str(port),
+               "--latency", args.latency, "--errors", args.errors or "",
+               "--response-words", str(args.response_words), "--token-delay", str(args.token_delay),
+               "--hang-seconds", str(args.hang_seconds)]
+    process = subprocess.Popen(command, cwd=os.path.dirname(os.path.abspath(__file__)))
+    deadline = time.time() + 10
+    while time.time() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+            return process, f"http://127.0.0.1:{port}"
+        except OSError:
+            time.sleep(0.05)
+    process.kill()
+    raise RuntimeError("mock server did not start")
+
+# =============================
+# Harness
+# =============================
+
+def peak_rss_mb():
+    """Peak RSS of this process; run_cell_isolated makes it a per-cell figure."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def run_cell(base_url, concurrency, turns, delay, conversations, args):
+    """One benchmark point; returns a JSON-serialisable dict."""
+    engine = ConversationEngine(concurrency)
+    engine.endpoints = {"nousresearch": base_url + MOCK_PATHS[0], "openrouter": base_url + MOCK_PATHS[1]}
+    engine.request_timeout = args.request_timeout
+    engine.streaming = args.stream
+    engine.configure_rate_limits(args.rpm_per_key)
+    latencies = LatencyHistogram()
+    engine.on_stats = lambda thread_id, seconds: latencies.record(seconds)
+
+    accounts = [Account(f"bench-nous-{i}", f"bench-or-{i}", "", "benchmark prompt") for i in range(conversations)]
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    futures = [engine.submit(account, turns, f"Bench-{i}", parse_delay_range(delay))
+               for i, account in enumerate(accounts)]
+    results = [future.result() for future in futures]
+    wall = time.perf_counter() - wall_start
+    cpu = time.process_time() - cpu_start
+    connections = engine.connection_stats()
+    errors = sum(series.errors for series in engine.latency.series["provider"].values())
+    rate_limited = engine.rate_governor.rate_limited
+    timing = engine.timing
+    engine.shutdown()
+
+    requests = latencies.count + errors
+    return {
+        "concurrency": concurrency,
+        "turns": turns,
+        "delay": delay,
+        "conversations": conversations,
+        "conversations_ok": sum(1 for ok in results if ok),
+        "wall_seconds": round(wall, 3),
+        "turns_completed": latencies.count,
+        "turns_per_sec": round(latencies.count / wall, 3) if wall > 0 else 0.0,
+        "latency_p50": latencies.percentile(50),
+        "latency_p90": latencies.percentile(90),
+        "latency_p99": latencies.percentile(99),
+        "latency_mean": latencies.mean(),
+        "request_errors": errors,
+        "rate_limited": rate_limited,
+        "network_seconds": round(timing.seconds["network"], 3),
+        "sleep_seconds": round(timing.sleeping(), 3),
+        "error_rate": round(errors / requests, 4) if requests else 0.0,
+        "cpu_seconds": round(cpu, 3),
+        "cpu_percent": round(cpu / wall * 100, 1) if wall > 0 else 0.0,
+        "peak_rss_mb": peak_rss_mb(),
+        "connections_opened": connections.opened,
+        "connections_reused": connections.reused,
+    }
+
+
+def run_cell_isolated(*cell_args):
+    """``run_cell`` in a fresh process: ru_maxrss only ever grows within one process."""
+    context = multiprocessing.get_context("spawn")
+    with concurrent.futures.ProcessPoolExecutor(1, mp_context=context) as pool:
+        return pool.submit(run_cell, *cell_args).result()
+
+
+def compare(results, baseline_path):
+    """Print turns/sec and p50 changes against an earlier results file."""
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    previous = {(r["concurrency"], r["turns"], r["delay"]): r for r in baseline.get("results", [])}
+    for r in results:
+        old = previous.get((r["concurrency"], r["turns"], r["delay"]))
+        if not old:
+            continue
+        for field in ("turns_per_sec", "latency_p50"):
+            if old.get(field) and r.get(field) is not None:
+                change = (r[field] - old[field]) / old[field] * 100
+                print(f"  c={r['concurrency']} turns={r['turns']} delay={r['delay']}: "
+                      f"{field} {old[field]:.3f} -> {r[field]:.3f} ({change:+.1f}%)")
+
+
+def run_matrix(args):
+    process, base_url = start_mock(args)
+    results = []
+    try:
+        for concurrency in args.concurrency:
+            for turns in args.turns:
+                for delay in args.delay:
+                    result = run_cell_isolated(base_url, concurrency, turns, delay, args.conversations, args)
+                    results.append(result)
+                    print(f"c={concurrency:<3} turns={turns:<3} delay={delay:<7} "
+                          f"{result['turns_per_sec']:>8.2f} turns/s  p50={result['latency_p50'] or 0:.3f}s "
+                          f"p99={result['latency_p99'] or 0:.3f}s  errors={result['error_rate'] * 100:.1f}%  "
+                          f"cpu={result['cpu_percent']}%  rss={result['peak_rss_mb']}MB")
+    finally:
+        process.terminate()
+        process.wait(5)
+
+    report = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "settings": {
+            "latency": args.latency, "errors": args.errors, "response_words": args.response_words,
+            "token_delay": args.token_delay, "stream": args.stream, "request_timeout": args.request_timeout,
+            "rpm_per_key": args.rpm_per_key,
+            "conversations": args.conversations,
+        },
+        "results": results,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"💾 Результаты сохранены в {args.output}")
+    if args.compare:
+        compare(results, args.compare)
+    return 0
+
+
+# =============================
+# Prompt library
+# =============================
+
+def write_prompt_file(path, size_mb, duplicate_ratio, seed=1):
+    """Synthetic prompt file: mostly distinct lines, some repeats and a few over-long ones."""
+    rng = random.Random(seed)
+    words = ["агент", "модель", "рынок", "риск", "данные", "этика", "токен", "протокол", "ликвидность", "код"]
+    written = []
+    size = 0
+    with open(path, "w", encoding="utf-8") as f:
+        while size < size_mb * 1024 * 1024:
+            if written and rng.random() < duplicate_ratio:
+                line = rng.choice(written)
+            else:
+                length = 400 if rng.random() < 0.01 else rng.randint(6, 30)
+                line = " ".join(rng.choice(words) for _ in range(length)) + f" #{len(written)}"
+                if len(written) < 10000:
+                    written.append(line)
+            f.write(line + "\n")
+            size += len(line.encode("utf-8")) + 1
+
+
+def load_prompt_list(path):
+    """Reading the whole file into a list: the loader the library replaced."""
+    with open(path, "r", encoding="utf-8") as f:
+        return [line for line in (raw.strip() for raw in f) if line and len(line) <= MAX_PROMPT_CHARS]
+
+
+def measure(load):
+    """(result, seconds, retained bytes, peak bytes); timed without tracemalloc, then traced."""
+    started = time.perf_counter()
+    load()
+    seconds = time.perf_counter() - started
+    tracemalloc.start()
+    result = load()
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, seconds, retained, peak
+
+
+def run_prompt_bench(args):
+    path = args.file
+    if path is None:
+        path = os.path.join(tempfile.mkdtemp(prefix="defi_ai_bench_"), "prompts.txt")
+        write_prompt_file(path, args.size_mb, args.duplicates)
+    size_mb = os.path.getsize(path) / (1024 * 1024)
+
+    prompts, list_seconds, list_retained, list_peak = measure(lambda: load_prompt_list(path))
+    list_count = len(prompts)
+    del prompts
+    library, lib_seconds, lib_retained, lib_peak = measure(lambda: PromptLibrary.from_file(path))
+    started = time.perf_counter()
+    for _ in range(args.lookups):
+        library.draw()
+    lookup_us = (time.perf_counter() - started) / args.lookups * 1e6
+
+    mb = 1024 * 1024
+    print(f"Файл: {path} ({size_mb:.1f} MB)")
+    print(f"список:     {list_count:>8} строк  {list_seconds:.3f} с  "
+          f"память {list_retained / mb:.1f} MB (пик {list_peak / mb:.1f} MB)")
+    print(f"библиотека: {len(library):>8} промптов  {lib_seconds:.3f} с  "
+          f"память {lib_retained / mb:.1f} MB (пик {lib_peak / mb:.1f} MB)  "
+          f"выборка {lookup_us:.1f} мкс")
+    print(f"  {library.summary()}")
+    library.close()
+    return 0
+
+
+def _int_list(value):
+    return [int(v) for v in value.split(",")]
+
+
+def _str_list(value):
+    return [v.strip() for v in value.split(",") if v.strip()]
+
+
+def add_mock_arguments(parser):
+    parser.add_argument("--latency", default="lognormal:0.3:0.4",
+                        help="fixed:S | uniform:LO:HI | lognormal:MEDIAN:SIGMA (default: %(default)s)")
+    parser.add_argument("--errors", default="", help="injected errors, e.g. 429=0.02,500=0.01,401=0,timeout=0.01")
+    parser.add_argument("--response-words", type=int, default=80)
+    parser.add_argument("--token-delay", type=float, default=0.0, help="seconds between streamed tokens")
+    parser.add_argument("--hang-seconds", type=float, default=5.0, help="how long an injected timeout hangs")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m defi_ai_bench", description="DeFi AI Club offline benchmark")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="run the benchmark matrix")
+    run_parser.add_argument("--concurrency", type=_int_list, default=[1, 4, 16])
+    run_parser.add_argument("--turns", type=_int_list, default=[4])
+    run_parser.add_argument("--delay", type=_str_list, default=["0"], help='delay settings as in the GUI, e.g. "0,1-2"')
+    run_parser.add_argument("--conversations", type=int, default=16)
+    run_parser.add_argument("--stream", action="store_true", help="use SSE streaming")
+    run_parser.add_argument("--request-timeout", type=float, default=2.0)
+    run_parser.add_argument("--rpm-per-key", type=int, default=0, help="0 = provider defaults")
+    run_parser.add_argument("--output", default="bench_results.json")
+    run_parser.add_argument("--compare", help="earlier results file to diff against")
+    add_mock_arguments(run_parser)
+
+    mock_parser = subparsers.add_parser("mock", help="only serve the mock endpoints")
+    mock_parser.add_argument("--port", type=int, default=8765)
+    add_mock_arguments(mock_parser)
+
+    prompts_parser = subparsers.add_parser("prompts", help="benchmark prompt library loading")
+    prompts_parser.add_argument("--file", help="prompt file to load (default: generate one)")
+    prompts_parser.add_argument("--size-mb", type=float, default=20.0, help="size of the generated file")
+    prompts_parser.add_argument("--duplicates", type=float, default=0.2, help="share of repeated lines")
+    prompts_parser.add_argument("--lookups", type=int, default=100000)
+
+    args = parser.parse_args(argv)
+    if args.command == "prompts":
+        return run_prompt_bench(args)
+    if args.command == "mock":
+        serve_mock(args)
+        return 0
+    return run_matrix(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,153 @@
+"""Circuit breakers per (provider, proxy endpoint).
+
+A breaker watches the outcome of recent requests to one endpoint.  Once
+enough of them fail with outage-like errors (timeouts, connection errors,
+5xx) it opens: calls are rejected without touching the network until the
+cooldown passes, then a single half-open probe decides whether it closes
+again.  The scheduler asks ``retry_in`` before starting queued work, so
+conversations wait out an outage instead of burning request timeouts.
+All methods must be called on the engine's event loop.
+"""
+
+import asyncio
+import time
+from collections import deque
+
+import aiohttp
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+DEFAULT_ERROR_RATE = 0.5
+DEFAULT_MIN_REQUESTS = 5
+DEFAULT_WINDOW = 60.0
+DEFAULT_COOLDOWN = 30.0
+
+
+def is_outage(error):
+    """True for failures that say the endpoint is down rather than the request is bad."""
+    if isinstance(error, aiohttp.ClientResponseError):
+        return error.status >= 500
+    return isinstance(error, (asyncio.TimeoutError, aiohttp.ClientConnectionError, aiohttp.ClientPayloadError))
+
+
+class CircuitBreaker:
+    """Closed -> open on a high error rate -> half-open probe after the cooldown."""
+
+    def __init__(self, error_rate=DEFAULT_ERROR_RATE, min_requests=DEFAULT_MIN_REQUESTS,
+                 window=DEFAULT_WINDOW, cooldown=DEFAULT_COOLDOWN):
+        self.error_rate = error_rate
+        self.min_requests = min_requests
+        self.window = window
+        self.cooldown = cooldown
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.probe_started = None
+        self.failures = 0
+        self._outcomes = deque()  # (monotonic time, ok)
+
+    def retry_in(self, now=None):
+        """Seconds until a call may go through; 0 when the breaker lets it pass."""
+        now = time.monotonic() if now is None else now
+        if self.state == OPEN:
+            return max(0.0, self.opened_at + self.cooldown - now)
+        if self.state == HALF_OPEN and self.probe_started is not None:
+            # A probe that never reported back (cancelled) expires after a cooldown
+            return max(0.0, self.probe_started + self.cooldown - now)
+        return 0.0
+
+    def allow(self, now=None):
+        """Whether a call may be made now; in half-open state the caller becomes the probe."""
+        now = time.monotonic() if now is None else now
+        if self.retry_in(now) > 0:
+            return False
+        if self.state != CLOSED:
+            self.state = HALF_OPEN
+            self.probe_started = now
+        return True
+
+    def record(self, ok, now=None):
+        now = time.monotonic() if now is None else now
+        if self.state == HALF_OPEN:
+            self.probe_started = None
+            if ok:
+                self._close()
+            else:
+                self._open(now)
+            return
+        self._outcomes.append((now, ok))
+        if not ok:
+            self.failures += 1
+        while self._outcomes and self._outcomes[0][0] < now - self.window:
+            if not self._outcomes.popleft()[1]:
+                self.failures -= 1
+        if (self.state == CLOSED and len(self._outcomes) >= self.min_requests
+                and self.failures / len(self._outcomes) >= self.error_rate):
+            self._open(now)
+
+    def _open(self, now):
+        self.state = OPEN
+        self.opened_at = now
+
+    def _close(self):
+        self.state = CLOSED
+        self._outcomes.clear()
+        self.failures = 0
+
+
+class BreakerRegistry:
+    """One shared breaker per (provider, proxy) pair."""
+
+    def __init__(self, error_rate=DEFAULT_ERROR_RATE, cooldown=DEFAULT_COOLDOWN):
+        self.error_rate = error_rate
+        self.cooldown = cooldown
+        self.rejected = 0
+        self._breakers = {}
+
+    def configure(self, error_rate=None, cooldown=None):
+        """New thresholds apply to existing breakers as well."""
+        if error_rate is not None:
+            self.error_rate = min(1.0, max(0.01, float(error_rate)))
+        if cooldown is not None:
+            self.cooldown = max(1.0, float(cooldown))
+        for breaker in list(self._breakers.values()):
+            breaker.error_rate = self.error_rate
+            breaker.cooldown = self.cooldown
+
+    def get(self, provider, proxy=None):
+        breaker = self._breakers.get((provider, proxy))
+        if breaker is None:
+            breaker = self._breakers[(provider, proxy)] = CircuitBreaker(self.error_rate, cooldown=self.cooldown)
+        return breaker
+
+    def retry_in(self, endpoints, now=None):
+        """Longest wait over ``endpoints`` ((provider, proxy) pairs) that already have breakers."""
+        now = time.monotonic() if now is None else now
+        waits = [self._breakers[key].retry_in(now) for key in endpoints if key in self._breakers]
+        return max(waits, default=0.0)
+
+    def not_closed(self):
+        """(provider, proxy, breaker) for every breaker that is open or probing."""
+        # Copied first: the GUI and the daemon read this while the engine thread adds breakers
+        return [(provider, proxy, breaker) for (provider, proxy), breaker in list(self._breakers.items())
+                if breaker.state != CLOSED]
+
+    def reset(self):
+        self.rejected = 0
+
+    def __str__(self):
+        tripped = self.not_closed()
+        if not tripped:
+            return "Автоматы: все закрыты"
+        now = time.monotonic()
+        parts = []
+        for provider, proxy, breaker in tripped[:3]:
+            where = f" через {proxy.rsplit('@', 1)[-1]}" if proxy else ""
+            if breaker.state == OPEN:
+                parts.append(f"{provider}{where} ⛔ {breaker.retry_in(now):.0f} с")
+            else:
+                parts.append(f"{provider}{where} 🔎 проба")
+        if len(tripped) > 3:
+            parts.append(f"ещё {len(tripped) - 3}")
+        return f"Автоматы: {' | '.join(parts)} | отклонено {self.rejected}"
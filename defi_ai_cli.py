@@ -0,0 +1,267 @@
+"""Headless batch runner for DeFi AI Club.
+
+Runs the conversations described by a config file written by the GUI's
+``save_config`` without loading PyQt5.  With a ``.db`` config (the GUI's
+SQLite store) the run and its turns are added to the store's history and the
+account counters are saved back::
+
+    python -m defi_ai_cli run --config defi_ai_config.json [--output run.log]
+    python -m defi_ai_cli run --config defi_ai.db
+    python -m defi_ai_cli import-config --json defi_ai_config.json [--db defi_ai.db]
+    python -m defi_ai_cli export-config --json backup.json [--db defi_ai.db]
+    python -m defi_ai_cli export --output turns.jsonl [--since ...] [--provider ...] [--status ...]
+    python -m defi_ai_cli check-proxies --config defi_ai_config.json [--test-url http://127.0.0.1:8765/ip]
+
+With ``metrics_port`` or ``metrics_file`` set in the config, run metrics are
+served on http://127.0.0.1:<port>/metrics and/or rewritten to that file
+while the run lasts.  ``trace``, ``profile_cpu`` and ``profile_memory``
+write a Chrome trace, a cProfile dump and a tracemalloc diff of the run into
+``trace_dir``.
+"""
+
+import argparse
+import sqlite3
+import sys
+import threading
+from datetime import datetime
+
+from defi_ai_core import CONFIG_FILE, accounts_from_config, load_default_prompts, parse_delay_range
+from defi_ai_engine import ConversationEngine, PROVIDER_NAMES
+from defi_ai_metrics import MetricsExporter
+from defi_ai_proxycheck import proxy_host
+from defi_ai_store import STORE_FILE, ConfigStore, open_config
+from defi_ai_trace import RunProfiler, write_run_trace
+from defi_ai_transcripts import TRANSCRIPT_DIR, TranscriptStore
+
+
+class RunWriter:
+    """Serialises engine events into lines on a text stream."""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self._lock = threading.Lock()
+
+    def write(self, line):
+        with self._lock:
+            self.stream.write(line + "\n")
+            self.stream.flush()
+
+    def on_update(self, thread_id, message):
+        self.write(f"[{thread_id}] {message}")
+
+
+class StreamStats:
+    """Time-to-first-token and generation speed of streamed replies."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.ttft = []
+        self.tokens_per_sec = []
+
+    def record(self, thread_id, ttft, tokens_per_sec):
+        with self._lock:
+            self.ttft.append(ttft)
+            self.tokens_per_sec.append(tokens_per_sec)
+
+    def __str__(self):
+        count = len(self.ttft)
+        return (f"⚡ Стриминг: {count} ответов, TTFT {sum(self.ttft) / count:.2f} с, "
+                f"{sum(self.tokens_per_sec) / count:.1f} ток/с")
+
+
+def configure_engine(engine, config):
+    """Apply the engine settings of ``config`` (the ``save_config`` format)."""
+    engine.set_max_concurrency(config["max_threads"])
+    engine.streaming = config["stream"]
+    engine.configure_pool(config["pool_size"], config["pool_idle_timeout"])
+    engine.configure_rate_limits(config["rpm_per_key"])
+    engine.configure_retries(config["retry_attempts"], config["turn_deadline"], config["retry_policies"])
+    engine.configure_breakers(config["breaker_error_rate"], config["breaker_cooldown"])
+    engine.configure_context(config["context_budget"], config["compact_context"], config["context_budgets"])
+    engine.configure_proxy_checks(config["proxy_test_url"], config["proxy_check_concurrency"],
+                                  config["proxy_cache_ttl"])
+    engine.configure_usage(config["prices"], config["max_run_tokens"], config["max_run_cost"],
+                           config["max_account_tokens"], config["max_account_cost"])
+    engine.configure_tracing(config["trace"])
+
+
+def run(config, stream, store=None):
+    """Run every enabled account from ``config``; returns (succeeded, failed).
+
+    ``store`` (a ConfigStore) receives the run history and account counters.
+    """
+    writer = RunWriter(stream)
+    manager = accounts_from_config(config)
+    accounts = manager.get_active_accounts()
+    if not accounts:
+        writer.write("❌ Нет активных аккаунтов для запуска")
+        return 0, 0
+    if store is not None:
+        store.apply_stats(accounts)
+        store.begin_run("cli", len(accounts))
+
+    if config["rotate_prompts"]:
+        prompts = load_default_prompts()
+        for account in accounts:
+            account.prompt = prompts.draw()
+
+    engine = ConversationEngine(config["max_threads"])
+    engine.on_update = writer.on_update
+    # Counters are only written here, on the engine thread, and read after the run
+    thread_accounts = {f"Thread-{i}": account for i, account in enumerate(accounts)}
+    engine.on_finished = lambda thread_id, success: manager.record_result(thread_accounts[thread_id], success)
+    engine.on_stats = lambda thread_id, seconds: thread_accounts[thread_id].record_latency(seconds)
+    engine.history = store
+    if config["transcripts"]:
+        engine.transcripts = TranscriptStore(max_bytes=int(config["transcript_max_mb"] * 1024 * 1024),
+                                             compress=config["transcript_compress"])
+    stream_stats = StreamStats()
+    engine.on_stream_stats = stream_stats.record
+    configure_engine(engine, config)
+    profiler = RunProfiler(config["profile_cpu"], config["profile_memory"])
+    profiler.start(engine.call_on_loop)
+    if config["warm_up"]:
+        engine.warm_up(accounts)
+    exporter = MetricsExporter(engine.metrics_text, config["metrics_port"], config["metrics_file"],
+                               config["metrics_interval"])
+    if exporter.enabled:
+        try:
+            exporter.start()
+            writer.write(f"📈 Метрики: {exporter}")
+        except OSError as e:
+            writer.write(f"❌ Метрики недоступны: {e}")
+
+    writer.write(f"🚀 Запуск {len(accounts)} аккаунтов...\n")
+    delay_range = parse_delay_range(config["delay"])
+    futures = [
+        engine.submit(account, config["turns"], thread_id, delay_range,
+                      config["nous_model"], config["or_model"])
+        for thread_id, account in thread_accounts.items()
+    ]
+    try:
+        results = [future.result() for future in futures]
+    except KeyboardInterrupt:
+        writer.write("\n⏹️ Остановка...")
+        engine.stop_all()
+        results = [future.result() for future in futures]
+    finally:
+        writer.write(str(engine.connection_stats()))
+        writer.write(str(engine.rate_governor))
+        writer.write(str(engine.timing))
+        writer.write(str(engine.breakers))
+        writer.write(f"📏 Токены контекста: {engine.prompt_tokens}")
+        writer.write(engine.usage.format_report())
+        if stream_stats.ttft:
+            writer.write(str(stream_stats))
+        writer.write("📈 Задержки:\n" + engine.latency.format_report())
+        exporter.stop()
+        for path in write_run_trace(engine.tracer, profiler, engine.call_on_loop, config["trace_dir"]).result():
+            writer.write(f"🔬 Трассировка: {path}")
+        engine.shutdown()
+        if engine.transcripts is not None:
+            engine.transcripts.close()
+
+    succeeded = sum(1 for ok in results if ok)
+    failed = len(results) - succeeded
+    writer.write(f"📊 Статистика: Успешно {succeeded}/{len(results)}")
+    if store is not None:
+        store.save_stats(accounts)
+        store.finish_run(succeeded, failed, engine.usage.summary())
+    return succeeded, failed
+
+
+def check_proxies(config, stream, test_url=None):
+    """Check every distinct proxy of the config's accounts; returns the number that failed."""
+    writer = RunWriter(stream)
+    proxies = list(dict.fromkeys(account.proxy for account in accounts_from_config(config).accounts
+                                 if account.proxy))
+    if not proxies:
+        writer.write("Нет прокси для проверки")
+        return 0
+    engine = ConversationEngine()
+    engine.configure_proxy_checks(test_url or config["proxy_test_url"], config["proxy_check_concurrency"],
+                                  config["proxy_cache_ttl"])
+    writer.write(f"🔍 Проверка {len(proxies)} прокси через {engine.proxy_checker.test_url}...")
+    try:
+        results = engine.check_proxies(
+            proxies, lambda result: writer.write(f"{proxy_host(result.proxy)}: {result.message}")).result()
+    finally:
+        engine.shutdown()
+    return sum(1 for result in results if not result.ok)
+
+
+def parse_time(value):
+    """Epoch seconds from an ISO date/time ("2026-10-17", "2026-10-17T12:30") or a number."""
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m defi_ai_cli", description="DeFi AI Club headless runner")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    run_parser = subparsers.add_parser("run", help="run conversations from a config file")
+    run_parser.add_argument("--config", default=CONFIG_FILE, help="config written by the GUI (default: %(default)s)")
+    run_parser.add_argument("--output", help="write the run log to this file instead of stdout")
+    check_parser = subparsers.add_parser("check-proxies", help="check the proxies of a config file")
+    check_parser.add_argument("--config", default=CONFIG_FILE, help="config written by the GUI (default: %(default)s)")
+    check_parser.add_argument("--test-url", help="URL fetched through each proxy (default: from the config)")
+    import_parser = subparsers.add_parser("import-config", help="load a JSON config into the SQLite store")
+    import_parser.add_argument("--json", default=CONFIG_FILE, help="JSON config (default: %(default)s)")
+    import_parser.add_argument("--db", default=STORE_FILE, help="SQLite store (default: %(default)s)")
+    export_config_parser = subparsers.add_parser("export-config", help="write the SQLite store as a JSON config")
+    export_config_parser.add_argument("--json", required=True, help="destination JSON file")
+    export_config_parser.add_argument("--db", default=STORE_FILE, help="SQLite store (default: %(default)s)")
+    export_parser = subparsers.add_parser("export", help="export recorded turns as JSONL")
+    export_parser.add_argument("--output", required=True, help="destination file (.jsonl or .jsonl.gz)")
+    export_parser.add_argument("--dir", default=TRANSCRIPT_DIR, help="transcript directory (default: %(default)s)")
+    export_parser.add_argument("--since", type=parse_time, help="only turns at or after this time")
+    export_parser.add_argument("--until", type=parse_time, help="only turns at or before this time")
+    export_parser.add_argument("--provider", choices=sorted(PROVIDER_NAMES.values()))
+    export_parser.add_argument("--status", choices=["ok", "error"])
+    args = parser.parse_args(argv)
+
+    if args.command == "export":
+        count = TranscriptStore(args.dir).export(args.output, since=args.since, until=args.until,
+                                                 provider=args.provider, status=args.status)
+        print(f"💾 Экспортировано {count} ходов в {args.output}")
+        return 0
+
+    if args.command in ("import-config", "export-config"):
+        store = ConfigStore(args.db)
+        try:
+            if args.command == "import-config":
+                config = store.import_json(args.json)
+                print(f"📂 Импортировано {len(config['accounts'])} аккаунтов из {args.json} в {args.db}")
+            else:
+                store.export_json(args.json)
+                print(f"💾 Конфигурация {args.db} сохранена в {args.json}")
+        except (OSError, ValueError) as e:
+            parser.error(str(e))
+        finally:
+            store.close()
+        return 0
+
+    try:
+        config, store = open_config(args.config)
+    except (OSError, ValueError, sqlite3.Error) as e:
+        parser.error(f"не удалось прочитать конфигурацию {args.config}: {e}")
+
+    try:
+        if args.command == "check-proxies":
+            return 1 if check_proxies(config, sys.stdout, args.test_url) else 0
+
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as stream:
+                succeeded, failed = run(config, stream, store)
+        else:
+            succeeded, failed = run(config, sys.stdout, store)
+        return 1 if failed else 0
+    finally:
+        if store is not None:
+            store.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,106 @@
+"""Token-budgeted prompt context for a conversation.
+
+``ContextBuilder`` owns a conversation's message history.  Every message is
+counted once when it is added; ``build`` then always keeps the system
+message and the opening prompt and fills the rest of the budget with the
+most recent messages, optionally squeezing older ones into a short excerpt
+instead of dropping them.  Token counts come from ``tiktoken`` when it is
+installed and from a byte-length estimate otherwise.
+"""
+
+import math
+
+try:
+    import tiktoken
+except ImportError:  # optional
+    tiktoken = None
+
+DEFAULT_CONTEXT_BUDGET = 3000
+MESSAGE_OVERHEAD = 4  # role and separators per chat message
+REPLY_PRIMING = 3
+COMPACT_CHARS = 240
+
+_encoding = None
+
+
+def count_tokens(text):
+    """Prompt tokens of ``text``: exact with tiktoken, about 4 UTF-8 bytes per token without."""
+    global _encoding
+    if tiktoken is not None and _encoding is None:
+        try:
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception:  # encoding files unavailable offline
+            _encoding = False
+    if _encoding:
+        return len(_encoding.encode(text))
+    return max(1, math.ceil(len(text.encode("utf-8")) / 4))
+
+
+def compact_text(text, limit=COMPACT_CHARS):
+    """First ``limit`` characters of ``text``, cut at a word boundary."""
+    text = " ".join(text.split())
+    if len(text) <= limit:
+        return text
+    cut = text.rfind(" ", 0, limit)
+    return text[:cut if cut > 0 else limit] + " …"
+
+
+class ContextMessage:
+    """A chat message with its token count computed once."""
+
+    __slots__ = ("role", "content", "tokens", "message", "_compacted")
+
+    def __init__(self, role, content):
+        self.role = role
+        self.content = content
+        self.tokens = count_tokens(content) + MESSAGE_OVERHEAD
+        self.message = {"role": role, "content": content}
+        self._compacted = None
+
+    def compacted(self):
+        if self._compacted is None:
+            short = compact_text(self.content)
+            self._compacted = self if short == self.content else ContextMessage(self.role, short)
+        return self._compacted
+
+
+class ContextBuilder:
+    """History of one conversation, rendered into a token budget per request."""
+
+    def __init__(self, system_prompt, compact=False):
+        self.system = ContextMessage("system", system_prompt)
+        self.compact = compact
+        self.entries = []
+
+    def add(self, role, content):
+        self.entries.append(ContextMessage(role, content))
+
+    def build(self, budget=DEFAULT_CONTEXT_BUDGET):
+        """(messages, prompt_tokens) for the next request.
+
+        The system message, the opening prompt and the latest message are
+        always included, even when they alone exceed ``budget``.
+        """
+        total = self.system.tokens + REPLY_PRIMING
+        pinned = self.entries[0] if self.entries else None
+        if pinned is not None:
+            total += pinned.tokens
+        chosen = []
+        for index in range(len(self.entries) - 1, 0, -1):
+            entry = self.entries[index]
+            if total + entry.tokens <= budget or not chosen:
+                chosen.append(entry)
+                total += entry.tokens
+                continue
+            if self.compact:
+                short = entry.compacted()
+                if total + short.tokens <= budget:
+                    chosen.append(short)
+                    total += short.tokens
+                    continue
+            break
+        messages = [self.system.message]
+        if pinned is not None:
+            messages.append(pinned.message)
+        messages.extend(entry.message for entry in reversed(chosen))
+        return messages, total
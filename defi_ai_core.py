@@ -0,0 +1,301 @@
+"""Qt-free core of DeFi AI Club: accounts, prompts and the config schema.
+
+Both the PyQt5 frontend and the headless ``defi_ai_cli`` runner build on this
+module and on ``defi_ai_engine``; nothing here imports Qt.
+"""
+
+import json
+import os
+import shutil
+import time
+from collections import deque
+
+from defi_ai_context import DEFAULT_CONTEXT_BUDGET
+from defi_ai_engine import DEFAULT_NOUS_MODEL, DEFAULT_OPENROUTER_MODEL
+from defi_ai_http import DEFAULT_POOL_SIZE, DEFAULT_IDLE_TIMEOUT
+from defi_ai_metrics import DEFAULT_METRICS_INTERVAL
+from defi_ai_prompts import PromptLibrary
+from defi_ai_proxycheck import DEFAULT_CACHE_TTL, DEFAULT_CHECK_CONCURRENCY, DEFAULT_TEST_URL
+from defi_ai_trace import TRACE_DIR
+
+# =============================
+# Configuration
+# =============================
+
+CONFIG_FILE = "defi_ai_config.json"
+
+# =============================
+# Dialog-first prompt database
+# =============================
+
+EMBEDDED_PROMPTS = [
+    "привет, давай как два эксперта подебатим про будущее AI и влияние на общество",
+    "окей, начну: какая роль человека остаётся, если агенты закрывают 90 процентов задач?",
+    "интересно, но как ты смотришь на риски централизации моделей и доступов?",
+    "хорошо, а теперь разверни мысль: как культура и искусство меняются, когда ИИ становится соавтором?",
+    "ладно, с философией ясно, а что с образованием - как перестроить курсы под агентоцентричный мир?",
+    "добавь контрудар: в каких кейсах человека точно не заменить и почему?",
+    "окей, давай про практику: как бы ты построил безопасную систему AI-агентов для банка?",
+    "смени угол: этика и правила - где граница между удобством и контролем?",
+    "хорошо, теперь про экосистемы - как open-source и проприетарные модели уживутся?",
+    "заверши раунд: каким будет рынок труда через 5 лет и какие навыки критичны?"
+]
+
+DEFAULT_PROMPTS_PATHS = [
+    os.path.join(os.getcwd(), "prompts_base.txt"),
+    os.path.join(os.path.dirname(__file__), "prompts_base.txt"),
+    "/mnt/data/prompts_base.txt"
+]
+
+def load_default_prompts(paths=None):
+    """PromptLibrary of the first non-empty file of DEFAULT_PROMPTS_PATHS, else of the embedded set.
+
+    Not called at import time: the GUI runs it in a background thread and the
+    CLI only when prompts are rotated.
+    """
+    for p in paths or DEFAULT_PROMPTS_PATHS:
+        try:
+            library = PromptLibrary.from_file(p)
+        except OSError:
+            continue
+        if len(library):
+            return library
+        library.close()
+    return PromptLibrary.from_prompts(EMBEDDED_PROMPTS)
+
+# =============================
+# Data classes
+# =============================
+
+class Account:
+    """Credentials of one account and its run counters.
+
+    The engine never writes to an account: it reports results through its
+    ``on_finished``/``on_stats`` callbacks and the frontend applies them with
+    ``AccountManager.record_result`` and ``record_latency`` on one thread.
+    Only the latest latency is kept, so every account takes the same memory
+    however many requests it made.
+    """
+
+    __slots__ = ("nous_key", "openrouter_key", "proxy", "prompt", "enabled",
+                 "usage_count", "success_count", "error_count", "last_used",
+                 "last_response_time")
+
+    def __init__(self, nous_key, openrouter_key, proxy, prompt, enabled=True):
+        self.nous_key = nous_key
+        self.openrouter_key = openrouter_key
+        self.proxy = proxy
+        self.prompt = prompt
+        self.enabled = enabled
+        self.usage_count = 0
+        self.success_count = 0
+        self.error_count = 0
+        self.last_used = None
+        self.last_response_time = None
+
+    def record_latency(self, seconds):
+        self.last_response_time = seconds
+
+class AccountManager:
+    def __init__(self):
+        self.accounts = []
+        # Totals over all accounts, kept in step by record_result and update_active
+        self.success_total = 0
+        self.error_total = 0
+        self.active_total = 0
+        
+    def add_account(self, nous_key, openrouter_key, proxy, prompt, enabled=True):
+        account = Account(nous_key, openrouter_key, proxy, prompt, enabled)
+        self.accounts.append(account)
+        self.active_total += self.is_active(account)
+        return account
+
+    @staticmethod
+    def is_active(account):
+        """Enabled and with at least one API key."""
+        return bool(account.enabled and (account.nous_key or account.openrouter_key))
+        
+    def get_active_accounts(self):
+        return [acc for acc in self.accounts if self.is_active(acc)]
+
+    def update_active(self, account, was_active):
+        """Adjust ``active_total`` after ``account`` was edited."""
+        self.active_total += self.is_active(account) - was_active
+
+    def record_result(self, account, success):
+        """Count one finished conversation of ``account``."""
+        account.usage_count += 1
+        account.last_used = time.strftime("%H:%M:%S")
+        if success:
+            account.success_count += 1
+            self.success_total += 1
+        else:
+            account.error_count += 1
+            self.error_total += 1
+
+    def recount(self):
+        """Recompute the totals after the accounts or their counters were replaced."""
+        self.success_total = sum(acc.success_count for acc in self.accounts)
+        self.error_total = sum(acc.error_count for acc in self.accounts)
+        self.active_total = sum(1 for acc in self.accounts if self.is_active(acc))
+        
+    def get_account_stats(self):
+        active = len(self.get_active_accounts())
+        total = len(self.accounts)
+        return f"Аккаунты: {active}/{total} активны"
+
+# =============================
+# Config schema
+# =============================
+
+DEFAULT_DELAY_RANGE = (2, 5)
+
+
+def default_config():
+    """Settings as written by the GUI's save_config, with no accounts."""
+    return {
+        "accounts": [],
+        "turns": 4,
+        "delay": "2-5",
+        "max_threads": 3,
+        "nous_model": DEFAULT_NOUS_MODEL,
+        "or_model": DEFAULT_OPENROUTER_MODEL,
+        "rotate_prompts": True,
+        "pool_size": DEFAULT_POOL_SIZE,
+        "pool_idle_timeout": DEFAULT_IDLE_TIMEOUT,
+        "rpm_per_key": 0,
+        "retry_attempts": 3,
+        "turn_deadline": 0,
+        "retry_policies": {},
+        "breaker_error_rate": 0.5,
+        "breaker_cooldown": 30,
+        "context_budget": DEFAULT_CONTEXT_BUDGET,
+        "context_budgets": {},
+        "compact_context": False,
+        "prices": {},
+        "max_run_tokens": 0,
+        "max_run_cost": 0,
+        "max_account_tokens": 0,
+        "max_account_cost": 0,
+        "proxy_test_url": DEFAULT_TEST_URL,
+        "proxy_check_concurrency": DEFAULT_CHECK_CONCURRENCY,
+        "proxy_cache_ttl": DEFAULT_CACHE_TTL,
+        "warm_up": True,
+        "stream": False,
+        "transcripts": True,
+        "transcript_compress": False,
+        "transcript_max_mb": 10,
+        "metrics_port": 0,
+        "metrics_file": "",
+        "metrics_interval": DEFAULT_METRICS_INTERVAL,
+        "trace": False,
+        "profile_cpu": False,
+        "profile_memory": False,
+        "trace_dir": TRACE_DIR,
+        "use_daemon": False
+    }
+
+
+def read_config(path=CONFIG_FILE):
+    """Load a config file, filling missing settings with defaults."""
+    with open(path, "r", encoding="utf-8") as f:
+        loaded = json.load(f)
+    config = default_config()
+    config.update(loaded)
+    return config
+
+
+def write_config(config, path=CONFIG_FILE):
+    """Write ``config`` atomically: a crash mid-save leaves the old file intact."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(config, f, ensure_ascii=False, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def parse_delay_range(delay_text):
+    """Parse "2-5" or "3" into a (min, max) tuple of seconds."""
+    try:
+        if "-" in delay_text:
+            min_delay, max_delay = map(float, delay_text.split("-"))
+            return (min_delay, max_delay)
+        delay = float(delay_text)
+        return (delay, delay)
+    except (TypeError, ValueError):
+        return DEFAULT_DELAY_RANGE
+
+
+def accounts_from_config(config, keep_empty=False):
+    """AccountManager with every config account that has at least one key (or all, with ``keep_empty``)."""
+    manager = AccountManager()
+    for acc in config.get("accounts", []):
+        nous_key = acc.get("nous_key", "").strip()
+        openrouter_key = acc.get("openrouter_key", "").strip()
+        if nous_key or openrouter_key or keep_empty:
+            manager.add_account(nous_key, openrouter_key, acc.get("proxy", "").strip(),
+                                acc.get("prompt", "").strip(), acc.get("enabled", True))
+    return manager
+
+# =============================
+# Run log
+# =============================
+
+LOG_DIR = "defi_ai_logs"
+
+
+class RunLog:
+    """Run log split into a drainable queue, a bounded tail and a file.
+
+    ``append`` is O(1) and safe from any thread.  The frontend periodically
+    calls ``drain`` to take everything queued since the last call; drained
+    lines are written to the run's file, which holds the full history, while
+    only the last ``max_lines`` messages are kept in memory.
+    """
+
+    def __init__(self, directory=LOG_DIR, max_lines=5000):
+        self.directory = directory
+        self.tail = deque(maxlen=max_lines)
+        self.path = None
+        self._queue = deque()
+        self._file = None
+
+    def append(self, message):
+        self._queue.append(message)
+
+    def drain(self):
+        batch = []
+        while self._queue:
+            batch.append(self._queue.popleft())
+        if batch:
+            self.tail.extend(batch)
+            self._write(batch)
+        return batch
+
+    def _write(self, batch):
+        if self._file is None:
+            os.makedirs(self.directory, exist_ok=True)
+            self.path = os.path.join(self.directory, time.strftime("run-%Y%m%d-%H%M%S.log"))
+            self._file = open(self.path, "a", encoding="utf-8")
+        self._file.write("\n".join(batch) + "\n")
+
+    def start_new(self):
+        """Close the current history file; the next drain opens a fresh one."""
+        self.drain()
+        self.close()
+        self.tail.clear()
+
+    def export(self, destination):
+        """Copy the full history of the current run to ``destination``."""
+        self.drain()
+        if self._file is None:
+            open(destination, "w", encoding="utf-8").close()
+            return
+        self._file.flush()
+        shutil.copyfile(self.path, destination)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
@@ -0,0 +1,423 @@
+"""Background engine process for DeFi AI Club.
+
+``EngineDaemon`` owns a ConversationEngine, the SQLite store and the
+transcript, metrics and trace outputs of its runs.  A run therefore goes on
+after the window that started it is closed.  Frontends connect over
+localhost TCP and exchange one JSON object per line.  The daemon writes its
+port and a random token to ``DAEMON_FILE``, and a client must send that
+token in its first message::
+
+    -> {"cmd": "attach", "token": "..."}
+    <- {"event": "attached", "run": {...} or null}
+    -> {"cmd": "start", "config": {...}}        the save_config format
+    <- {"event": "started", "threads": {"Thread-0": <account position>, ...}}
+       or {"event": "start_failed", "message": "..."} to that client only
+    <- {"event": "update" | "progress" | "finished" | "stats" | "stream_stats", "args": [...]}
+    <- {"event": "snapshot", "states": {...}, "reports": {...}}   twice a second
+    -> {"cmd": "set_concurrency", "value": N}   resizes the worker pool mid-run
+    -> {"cmd": "stop"}
+    <- {"event": "stopped", "args": [seconds, still running]}
+    <- {"event": "run_finished", "args": [succeeded, failed], "report": "..."}
+    -> {"cmd": "shutdown"}
+
+Every attached client gets every event.  ``attached`` carries the current
+run with the tail of its log, so a client can reattach in the middle of a
+run.  Accounts are identified by their position in the config's account
+list, empty rows included::
+
+    python -m defi_ai_daemon [--db defi_ai.db] [--port 0]
+"""
+
+import argparse
+import asyncio
+import hmac
+import json
+import os
+import secrets
+import socket
+from collections import deque
+
+from defi_ai_cli import configure_engine
+from defi_ai_core import accounts_from_config, default_config, load_default_prompts, parse_delay_range
+from defi_ai_engine import ConversationEngine
+from defi_ai_metrics import MetricsExporter
+from defi_ai_store import STORE_FILE, ConfigStore
+from defi_ai_trace import RunProfiler, write_run_trace
+from defi_ai_transcripts import TranscriptStore
+
+DAEMON_FILE = "defi_ai_daemon.json"
+DAEMON_HOST = "127.0.0.1"
+SNAPSHOT_INTERVAL = 0.5
+LOG_BACKLOG = 2000
+MAX_MESSAGE_BYTES = 16 * 1024 * 1024
+# A client this far behind on reading events is disconnected
+MAX_CLIENT_BUFFER = 4 * 1024 * 1024
+
+ENGINE_EVENTS = ("update", "progress", "finished", "stats", "stream_stats")
+
+
+def read_daemon_info(path=DAEMON_FILE):
+    """{"host", "port", "token", "pid"} written by the running daemon, or None."""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def encode(message):
+    return (json.dumps(message, ensure_ascii=False) + "\n").encode("utf-8")
+
+
+class DaemonRun:
+    """A run's conversations and what a reattaching client needs to redraw them."""
+
+    def __init__(self, thread_accounts, positions):
+        self.thread_accounts = thread_accounts  # thread_id -> Account
+        self.threads = {thread_id: {"position": positions[thread_id], "progress": 0,
+                                    "status": "⏳ В очереди", "done": False}
+                        for thread_id in thread_accounts}
+        self.log = deque(maxlen=LOG_BACKLOG)
+        self.pending = len(thread_accounts)
+        self.succeeded = self.failed = 0
+        self.running = True
+
+    def as_dict(self):
+        return {"threads": self.threads, "log": list(self.log), "running": self.running,
+                "succeeded": self.succeeded, "failed": self.failed}
+
+
+class EngineDaemon:
+    """Runs conversations for any number of attached clients on localhost."""
+
+    def __init__(self, store_path=STORE_FILE, host=DAEMON_HOST, port=0, info_path=DAEMON_FILE):
+        self.store_path = store_path
+        self.host = host
+        self.port = port
+        self.info_path = info_path
+        self.token = secrets.token_hex(16)
+        self.engine = ConversationEngine()
+        for kind in ENGINE_EVENTS:
+            setattr(self.engine, "on_" + kind, self._relay(kind))
+        self.store = None
+        self.manager = None
+        self.run = None
+        self.transcripts = None
+        self.exporter = None
+        self.profiler = None
+        self.trace_dir = None
+        self.thread_counter = 0
+        self.starting = False  # a start is waiting for the prompt library
+        self.clients = set()
+        self._loop = None
+        self._closed = None
+
+    # ---- engine events ----
+
+    def _call_soon(self, fn, *args):
+        """Schedule ``fn`` on the daemon loop from the engine thread."""
+        try:
+            self._loop.call_soon_threadsafe(fn, *args)
+        except RuntimeError:  # daemon loop already closed during shutdown
+            pass
+
+    def _relay(self, kind):
+        """Engine callback that hands the event over to the daemon loop."""
+        return lambda *args: self._call_soon(self._on_engine_event, kind, args)
+
+    def _on_engine_event(self, kind, args):
+        run = self.run
+        thread_id = args[0]
+        thread = run.threads.get(thread_id) if run is not None else None
+        if thread is not None:
+            if kind == "update":
+                run.log.append(f"[{thread_id}] {args[1]}")
+            elif kind == "progress" and args[1] < 100:
+                thread["progress"] = args[1]
+                thread["status"] = f"▶️ {args[1]}%"
+            elif kind == "stats":
+                run.thread_accounts[thread_id].record_latency(args[1])
+            elif kind == "finished" and not thread["done"]:
+                self._thread_finished(run, thread_id, thread, args[1])
+        self._broadcast({"event": kind, "args": list(args)})
+        if kind == "finished" and run is not None and run.running and not run.pending:
+            self._finish_run()
+
+    def _thread_finished(self, run, thread_id, thread, success):
+        account = run.thread_accounts[thread_id]
+        self.manager.record_result(account, success)
+        self.store.save_stats([account])
+        self.store.flush()
+        thread.update(done=True, progress=100, status="✅ Готово" if success else "❌ Ошибка")
+        run.pending -= 1
+        if success:
+            run.succeeded += 1
+        else:
+            run.failed += 1
+
+    def _log(self, message):
+        if self.run is not None:
+            self.run.log.append(message)
+        self._broadcast({"event": "log", "message": message})
+
+    # ---- runs ----
+
+    async def _start(self, config):
+        """Start a run of ``config``; returns an error message or None."""
+        if self.starting or (self.run is not None and self.run.running):
+            return "Запуск уже выполняется"
+        self.starting = True
+        try:
+            return await self._start_run(config)
+        finally:
+            self.starting = False
+
+    async def _start_run(self, config):
+        full_config = default_config()
+        full_config.update(config)
+        config = full_config
+        # Empty rows are kept so positions match the client's account list
+        manager = accounts_from_config(config, keep_empty=True)
+        thread_accounts = {}
+        positions = {}
+        for position, account in enumerate(manager.accounts):
+            if manager.is_active(account):
+                thread_id = f"Thread-{self.thread_counter}"
+                self.thread_counter += 1
+                thread_accounts[thread_id] = account
+                positions[thread_id] = position
+        if not thread_accounts:
+            return "Нет активных аккаунтов для запуска"
+        accounts = list(thread_accounts.values())
+        self.manager = manager
+        self.store.apply_stats(accounts)
+        if config["rotate_prompts"]:
+            # File I/O: off the loop that serves every client
+            prompts = await asyncio.get_running_loop().run_in_executor(None, load_default_prompts)
+            for account in accounts:
+                account.prompt = prompts.draw()
+
+        configure_engine(self.engine, config)
+        self._configure_outputs(config)
+        self.engine.begin_run()
+        self.profiler = RunProfiler(config["profile_cpu"], config["profile_memory"])
+        self.profiler.start(self.engine.call_on_loop)
+        self.trace_dir = config["trace_dir"]
+        self.store.begin_run("daemon", len(accounts))
+        self.run = DaemonRun(thread_accounts, positions)
+        self._broadcast({"event": "started", "threads": positions})
+        if config["warm_up"]:
+            self.engine.warm_up(accounts)
+        delay_range = parse_delay_range(config["delay"])
+        for thread_id, account in thread_accounts.items():
+            self.engine.submit(account, config["turns"], thread_id, delay_range,
+                               config["nous_model"], config["or_model"])
+        return None
+
+    def _configure_outputs(self, config):
+        self.engine.history = self.store
+        if config["transcripts"]:
+            if self.transcripts is None:
+                self.transcripts = TranscriptStore()
+            self.transcripts.compress = config["transcript_compress"]
+            self.transcripts.max_bytes = int(config["transcript_max_mb"] * 1024 * 1024)
+            self.engine.transcripts = self.transcripts
+        else:
+            self.engine.transcripts = None
+        settings = (int(config["metrics_port"] or 0), config["metrics_file"] or "",
+                    max(1.0, float(config["metrics_interval"])))
+        current = self.exporter
+        if current is not None and (current.port, current.path, current.interval) == settings:
+            return
+        if current is not None:
+            current.stop()
+            self.exporter = None
+        exporter = MetricsExporter(self.engine.metrics_text, *settings)
+        if exporter.enabled:
+            try:
+                exporter.start()
+                self.exporter = exporter
+            except OSError as e:
+                self._log(f"❌ Метрики недоступны: {e}")
+
+    def _stop(self):
+        drained = self.engine.stop_all()
+        drained.add_done_callback(lambda future: self._call_soon(self._on_stopped, future.result()))
+
+    def _on_stopped(self, result):
+        self._broadcast({"event": "stopped", "args": list(result)})
+        run = self.run
+        if run is not None and run.running:
+            for thread in run.threads.values():
+                if not thread["done"]:
+                    thread.update(done=True, status="⏹️ Остановлен")
+            self._finish_run()
+
+    def _finish_run(self):
+        run = self.run
+        run.running = False
+        self.store.save_stats(list(run.thread_accounts.values()))
+        self.store.finish_run(run.succeeded, run.failed, self.engine.usage.summary())
+        traced = write_run_trace(self.engine.tracer, self.profiler, self.engine.call_on_loop, self.trace_dir)
+        traced.add_done_callback(lambda future: self._call_soon(self._on_trace_written, future))
+        self._broadcast({"event": "run_finished", "args": [run.succeeded, run.failed],
+                         "report": self.engine.usage.format_report()})
+
+    def _on_trace_written(self, future):
+        try:
+            for path in future.result():
+                self._log(f"🔬 Трассировка: {path}")
+        except Exception as e:
+            self._log(f"❌ Ошибка записи трассировки: {str(e)}")
+
+    def snapshot(self):
+        """Counters and report texts the GUI shows in its panels."""
+        engine = self.engine
+        return {"event": "snapshot", "states": dict(engine.state_counts), "reports": {
+            "latency": engine.latency.format_report(),
+            "rate_limit": str(engine.rate_governor),
+            "timing": str(engine.timing),
+            "breakers": str(engine.breakers),
+            "usage": str(engine.usage),
+            "usage_report": engine.usage.format_report(),
+            "connections": str(engine.connection_stats()),
+            "prompt_tokens": engine.prompt_tokens,
+        }}
+
+    # ---- clients ----
+
+    def _send(self, writer, data):
+        if writer.transport.get_write_buffer_size() > MAX_CLIENT_BUFFER:
+            self.clients.discard(writer)
+            writer.close()
+            return
+        writer.write(data)
+
+    def _broadcast(self, message):
+        if self.clients:
+            data = encode(message)
+            for writer in list(self.clients):
+                self._send(writer, data)
+
+    async def _serve_client(self, reader, writer):
+        try:
+            hello = json.loads(await reader.readline())
+        except (ValueError, ConnectionError, asyncio.LimitOverrunError):
+            hello = None
+        if (not isinstance(hello, dict) or hello.get("cmd") != "attach"
+                or not hmac.compare_digest(str(hello.get("token", "")), self.token)):
+            writer.close()
+            return
+        self._send(writer, encode({"event": "attached", "pid": os.getpid(),
+                                   "run": self.run.as_dict() if self.run is not None else None}))
+        self._send(writer, encode(self.snapshot()))
+        self.clients.add(writer)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    message = json.loads(line)
+                except ValueError:
+                    continue
+                await self._command(writer, message)
+        except (ConnectionError, asyncio.LimitOverrunError, ValueError):
+            pass
+        finally:
+            self.clients.discard(writer)
+            writer.close()
+
+    async def _command(self, writer, message):
+        command = message.get("cmd")
+        if command == "start":
+            error = await self._start(message.get("config") or {})
+            if error:
+                self._send(writer, encode({"event": "start_failed", "message": error}))
+        elif command == "set_concurrency":
+            self.engine.set_max_concurrency(message.get("value", 1))
+        elif command == "stop":
+            self._stop()
+        elif command == "shutdown":
+            self._stop()
+            self._closed.set()
+        else:
+            self._send(writer, encode({"event": "error", "message": f"Неизвестная команда: {command}"}))
+
+    async def _snapshots(self):
+        while True:
+            await asyncio.sleep(SNAPSHOT_INTERVAL)
+            if self.clients:
+                self._broadcast(self.snapshot())
+
+    def _write_info(self):
+        tmp_path = self.info_path + ".tmp"
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump({"host": self.host, "port": self.port, "token": self.token, "pid": os.getpid()}, f)
+        os.replace(tmp_path, self.info_path)
+
+    def _remove_info(self):
+        info = read_daemon_info(self.info_path)
+        if info is not None and info.get("token") == self.token:
+            os.remove(self.info_path)
+
+    async def serve(self):
+        """Serve until a client sends ``shutdown``."""
+        self._loop = asyncio.get_running_loop()
+        self._closed = asyncio.Event()
+        self.store = ConfigStore(self.store_path)
+        server = await asyncio.start_server(self._serve_client, self.host, self.port, limit=MAX_MESSAGE_BYTES)
+        self.port = server.sockets[0].getsockname()[1]
+        self._write_info()
+        snapshots = asyncio.ensure_future(self._snapshots())
+        try:
+            await self._closed.wait()
+        finally:
+            snapshots.cancel()
+            self._remove_info()
+            for writer in list(self.clients):
+                writer.close()
+            self.clients.clear()
+            server.close()
+            if self.run is not None and self.run.running:
+                self._finish_run()
+            await self._loop.run_in_executor(None, self.engine.shutdown)
+            if self.exporter is not None:
+                self.exporter.stop()
+            if self.transcripts is not None:
+                self.transcripts.close()
+            self.store.close()
+
+
+def daemon_running(info):
+    """Whether a daemon answers at the address in ``info``."""
+    try:
+        with socket.create_connection((info.get("host", DAEMON_HOST), info["port"]), timeout=1):
+            return True
+    except (OSError, KeyError, TypeError):
+        return False
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m defi_ai_daemon", description="DeFi AI Club engine daemon")
+    parser.add_argument("--db", default=STORE_FILE, help="SQLite store (default: %(default)s)")
+    parser.add_argument("--port", type=int, default=0, help="TCP port on 127.0.0.1 (default: any free port)")
+    parser.add_argument("--info", default=DAEMON_FILE, help="file the port and token are written to "
+                                                            "(default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    info = read_daemon_info(args.info)
+    if info is not None and daemon_running(info):
+        print(f"Демон уже запущен (pid {info.get('pid')}, порт {info.get('port')})")
+        return 1
+    daemon = EngineDaemon(args.db, port=args.port, info_path=args.info)
+    try:
+        asyncio.run(daemon.serve())
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
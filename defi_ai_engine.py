@@ -0,0 +1,889 @@
+"""Asyncio conversation engine for DeFi AI Club.
+
+Every conversation runs as a coroutine on a single event loop that lives in
+one background thread.  A pool of worker coroutines caps how many
+conversations talk to the providers at once, and a shared ``RateGovernor``
+paces their requests per provider and API key, so idle conversations cost a
+queue entry instead of an OS thread.
+
+The engine is Qt-free: frontends subscribe to its events through the
+``on_update``/``on_progress``/``on_finished``/``on_stats`` callbacks (plus
+``on_stream_stats`` for time-to-first-token in streaming mode), which are
+invoked from the engine thread.  ``metrics`` keeps lifetime counters for
+the metrics exporter and ``tracer`` records per-turn spans when enabled.
+Accounts are read-only here: their counters are updated by the frontend
+from ``on_finished`` and ``on_stats``.
+"""
+
+import asyncio
+import concurrent.futures
+import json
+import sys
+import threading
+import time
+import traceback
+
+import aiohttp
+
+from defi_ai_breaker import BreakerRegistry, OPEN, is_outage
+from defi_ai_context import DEFAULT_CONTEXT_BUDGET, MESSAGE_OVERHEAD, ContextBuilder, count_tokens
+from defi_ai_http import SessionPool
+from defi_ai_metrics import EngineMetrics
+from defi_ai_proxycheck import ProxyChecker
+from defi_ai_ratelimit import RateGovernor
+from defi_ai_retry import Pacer, RetryPolicy
+from defi_ai_stats import LatencyStats, RunTiming
+from defi_ai_trace import Tracer
+from defi_ai_usage import UsageLedger
+
+# =============================
+# Models & API config
+# =============================
+
+DEFAULT_NOUS_MODEL = "Hermes-4-70B"
+DEFAULT_OPENROUTER_MODEL = "openai/gpt-3.5-turbo"
+
+NOUS_API_URL = "https://inference-api.nousresearch.com/v1/chat/completions"
+OPENROUTER_API_URL = "https://openrouter.ai/api/v1/chat/completions"
+
+SYSTEM_PREAMBLE = (
+    "You are participating in a structured, respectful, concise expert debate. "
+    "Each turn, reply in 2-6 sentences. Build directly on the peer's previous point. "
+    "Avoid repetition; introduce one new argument or evidence per turn."
+)
+
+# Sent right after the opponent's reply, which is already in the context
+FOLLOWUP_USER_PROMPT = (
+    "Это был ход оппонента. "
+    "Сформулируй следующий короткий ход дискуссии, добавь 1 новый аргумент и 1 уточняющий вопрос."
+)
+
+PROVIDER_NAMES = {"nousresearch": "NousResearch", "openrouter": "OpenRouter"}
+
+REQUEST_TIMEOUT = 30
+
+# 429s a single request may wait out before the turn is reported as failed
+MAX_RATE_LIMIT_RETRIES = 5
+
+DEADLINE_ERROR = "Ошибка: Превышено время хода"
+BREAKER_ERROR = "Ошибка: Провайдер недоступен (автомат разомкнут)"
+
+# How long a queued conversation waits for an open breaker before it fails
+MAX_BREAKER_WAIT = 300.0
+# Running conversations are cancelled at once; stop_all reports any still running after this long
+STOP_TIMEOUT = 1.0
+
+# Conversation states
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+STATES = (QUEUED, RUNNING, DONE, FAILED, CANCELLED)
+
+
+def format_proxy(proxy):
+    """Convert host:port:user:pass to proper format"""
+    if not proxy:
+        return None
+
+    proxy_parts = proxy.split(':')
+    if len(proxy_parts) == 4:
+        host, port, user, password = proxy_parts
+        return f"http://{user}:{password}@{host}:{port}"
+    elif len(proxy_parts) == 2:
+        host, port = proxy_parts
+        return f"http://{host}:{port}"
+    else:
+        return f"http://{proxy}"
+
+
+def account_id(account):
+    """Stable identity of an account: its key pair, as in the store's account_stats."""
+    return (account.nous_key, account.openrouter_key)
+
+
+def account_label(account):
+    """Short, key-derived name of an account for logs; several accounts may share one."""
+    if account.nous_key:
+        return account.nous_key[:8] + "..."
+    if account.openrouter_key:
+        return account.openrouter_key[:8] + "..."
+    return "no-key"
+
+
+def _noop(*args):
+    pass
+
+
+def _error_code(error):
+    """Metrics label of a failed request: its HTTP status or the kind of error."""
+    if isinstance(error, aiohttp.ClientResponseError):
+        return error.status
+    if isinstance(error, asyncio.TimeoutError):
+        return "timeout"
+    if isinstance(error, aiohttp.ClientConnectionError):
+        return "connection"
+    return "error"
+
+
+def _remaining(deadline):
+    """Seconds left until a monotonic deadline; None means no deadline."""
+    return None if deadline is None else max(0.0, deadline - time.monotonic())
+
+
+class StreamPrinter:
+    """Forwards streamed text line by line instead of one log entry per token."""
+
+    MAX_PENDING = 160
+
+    def __init__(self, emit):
+        self.emit = emit
+        self.pending = ""
+
+    def feed(self, text):
+        self.pending += text
+        while "\n" in self.pending:
+            line, self.pending = self.pending.split("\n", 1)
+            if line.strip():
+                self.emit(line)
+        if len(self.pending) >= self.MAX_PENDING:
+            cut = self.pending.rfind(" ")
+            if cut <= 0:
+                cut = len(self.pending)
+            self.emit(self.pending[:cut])
+            self.pending = self.pending[cut:].lstrip()
+
+    def flush(self):
+        if self.pending.strip():
+            self.emit(self.pending)
+        self.pending = ""
+
+# =============================
+# Conversation coroutine
+# =============================
+
+class Conversation:
+    """One account's dialog between NousResearch and OpenRouter."""
+
+    def __init__(self, engine, account, turns, thread_id, delay_range=(1, 3),
+                 nous_model=DEFAULT_NOUS_MODEL, or_model=DEFAULT_OPENROUTER_MODEL):
+        self.engine = engine
+        self.account = account
+        self.turns = turns
+        self.thread_id = thread_id
+        self.delay_range = delay_range
+        self.pacer = Pacer(delay_range)
+        self.running = True
+        self.nous_model = nous_model
+        self.or_model = or_model
+        self.progress = 0
+        self.account_id = account_id(account)
+        self.label = account_label(account)
+        self.state = QUEUED
+        self.deferred_since = None
+        self.last_usage = None  # (prompt tokens, completion tokens, cost) of the last reply
+        self.last_latency = None
+        self.task = None  # asyncio task while running
+        self.queued_at = None
+        self.started_at = None
+        self.future = concurrent.futures.Future()
+
+    def stop(self):
+        """Cancel the conversation wherever it waits (request, backoff, pacing); engine thread only."""
+        self.running = False
+        if self.task is not None and not self.task.done():
+            self.task.cancel()
+
+    def endpoints(self):
+        """(provider, proxy) pairs this conversation will call, as keyed by the breakers."""
+        proxy = format_proxy(self.account.proxy) if self.account.proxy else None
+        return [(PROVIDER_NAMES[api_type], proxy)
+                for api_type, key in (("nousresearch", self.account.nous_key),
+                                      ("openrouter", self.account.openrouter_key)) if key]
+
+    async def validate_proxy(self, proxy):
+        """Проверка работоспособности прокси (через общий кэш проверок)"""
+        formatted_proxy = format_proxy(proxy)
+        if not formatted_proxy:
+            return False
+        result = await self.engine.proxy_checker.check(proxy, formatted_proxy)
+        return result.ok
+
+    async def query_api(self, messages, api_type, api_key, model, proxy=None, on_text=None):
+        """Улучшенный запрос к API с retry logic
+
+        Attempts, backoff and the per-turn deadline come from the provider's
+        ``RetryPolicy``; requests are spaced by the conversation's ``Pacer``.
+        In streaming mode the reply is read as server-sent events and passed
+        to ``on_text`` as it arrives.
+        """
+        streaming = self.engine.streaming
+        governor = self.engine.rate_governor
+        policy = self.engine.retry_policies[api_type]
+        timing = self.engine.timing
+        metrics = self.engine.metrics
+        tracer = self.engine.tracer
+        track = self.thread_id
+        provider = PROVIDER_NAMES[api_type]
+        formatted_proxy = format_proxy(proxy) if proxy else None
+        breaker = self.engine.breakers.get(provider, formatted_proxy)
+        pacing_since = time.monotonic()
+        timing.add("pacing", await self.pacer.wait())
+        tracer.add("pacing", track, pacing_since)
+        deadline = policy.deadline_at()
+        attempt = 0
+        rate_limited = 0
+        while True:
+            if not breaker.allow():
+                # Endpoint is down: fail fast instead of waiting for timeouts
+                self.engine.breakers.rejected += 1
+                return BREAKER_ERROR
+            waiting_since = time.monotonic()
+            try:
+                await asyncio.wait_for(governor.acquire(api_type, api_key), _remaining(deadline))
+            except asyncio.TimeoutError:
+                timing.add("rate_limit", time.monotonic() - waiting_since)
+                return DEADLINE_ERROR
+            sent_at = time.monotonic()
+            timing.add("rate_limit", sent_at - waiting_since)
+            tracer.add("rate_limit", track, waiting_since, sent_at)
+            self.pacer.mark()
+            start_time = time.time()
+            try:
+                url = self.engine.endpoints[api_type]
+                if api_type == "nousresearch":
+                    headers = {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
+                else:
+                    headers = {
+                        "Authorization": f"Bearer {api_key}", "Content-Type": "application/json",
+                        "HTTP-Referer": "https://deficlub.pro", "X-Title": "DeFi AI Club"
+                    }
+
+                payload = {"model": model, "messages": messages, "max_tokens": 500}
+                if streaming:
+                    payload["stream"] = True
+                    payload["stream_options"] = {"include_usage": True}
+                timeout = self.engine.request_timeout
+                if deadline is not None:
+                    timeout = max(0.001, min(timeout, _remaining(deadline)))
+
+                # Checked out until the body or stream is read, so idle eviction never closes it mid-reply
+                with self.engine.session_pool.session(url, formatted_proxy) as session:
+                    async with session.post(url, headers=headers, json=payload, proxy=formatted_proxy,
+                                            timeout=aiohttp.ClientTimeout(total=timeout),
+                                            trace_request_ctx=track) as response:
+                        headers_at = time.monotonic()
+                        code = response.status
+                        tracer.add("ttfb", track, sent_at, headers_at, status=code)
+                        response.raise_for_status()
+                        governor.on_response(api_type, api_key, response.headers)
+                        if streaming:
+                            content, usage = await self._read_stream(response, start_time, on_text or _noop)
+                            tracer.add("stream", track, headers_at)
+                        else:
+                            body = await response.read()
+                            read_at = time.monotonic()
+                            tracer.add("body", track, headers_at, read_at, bytes=len(body))
+                            data = json.loads(body)
+                            content = data['choices'][0]['message']['content']
+                            usage = data.get('usage')
+                            tracer.add("parse", track, read_at)
+
+                breaker.record(True)
+                response_time = time.time() - start_time
+                timing.add("network", response_time)
+                self.last_latency = response_time
+                metrics.request(provider, code, response_time)
+                tracer.add("request", track, sent_at, provider=provider, status=code)
+                self.engine.latency.record(provider, model, self.account_id, response_time, label=self.label)
+                self.engine.on_stats(self.thread_id, response_time)
+                self._record_usage(api_type, model, messages, content, usage)
+                return content
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                breaker.record(not is_outage(e))
+                elapsed = time.time() - start_time
+                timing.add("network", elapsed)
+                code = _error_code(e)
+                metrics.request(provider, code, elapsed)
+                tracer.add("request", track, sent_at, provider=provider, status=code)
+                self.engine.latency.record(provider, model, self.account_id, elapsed, ok=False, label=self.label)
+                if (isinstance(e, aiohttp.ClientResponseError) and e.status == 429
+                        and rate_limited < MAX_RATE_LIMIT_RETRIES):
+                    # Wait in the governor's queue instead of failing the turn
+                    rate_limited += 1
+                    metrics.retry(provider, "rate_limited")
+                    wait = governor.on_rate_limited(api_type, api_key, e.headers)
+                    self.engine.on_update(self.thread_id,
+                                          f"⏳ {provider}: лимит запросов, повтор через {wait:.1f} с")
+                    continue
+                attempt += 1
+                if attempt >= policy.max_attempts or not policy.is_retryable(e):
+                    return self._describe_error(e)
+                if breaker.state == OPEN:
+                    return BREAKER_ERROR
+                backoff = policy.backoff(attempt - 1)
+                if deadline is not None and backoff >= _remaining(deadline):
+                    return DEADLINE_ERROR
+                timing.add("backoff", backoff)
+                metrics.retry(provider, "backoff")
+                backoff_since = time.monotonic()
+                await asyncio.sleep(backoff)
+                tracer.add("backoff", track, backoff_since)
+            finally:
+                governor.release()
+
+    def _describe_error(self, e):
+        """Error text a failed request is reported with"""
+        if isinstance(e, asyncio.TimeoutError):
+            return "Ошибка: Таймаут соединения"
+        if isinstance(e, aiohttp.ClientConnectionError):
+            return "Ошибка: Проблема с соединение"
+        if isinstance(e, aiohttp.ClientResponseError):
+            if e.status == 401:
+                return "Ошибка: Неверный API ключ"
+            if e.status == 429:
+                return "Ошибка: Лимит запросов превышен"
+            return f"Ошибка HTTP: {str(e)}"
+        return f"Ошибка {type(e).__name__}: {str(e)}"
+
+    async def _read_stream(self, response, start_time, on_text):
+        """Collect an SSE chat-completions stream; stops early once the conversation is stopped."""
+        printer = StreamPrinter(on_text)
+        parts = []
+        first_token_at = None
+        chunks = 0
+        usage = None
+        async for raw_line in response.content:
+            if not self.running:
+                response.close()
+                break
+            line = raw_line.decode("utf-8", errors="replace").strip()
+            if not line.startswith("data:"):
+                continue
+            data = line[5:].strip()
+            if data == "[DONE]":
+                break
+            chunk = json.loads(data)
+            if "error" in chunk:
+                raise RuntimeError(chunk["error"].get("message", chunk["error"]))
+            usage = chunk.get("usage") or usage
+            for choice in chunk.get("choices") or []:
+                text = (choice.get("delta") or {}).get("content")
+                if text:
+                    if first_token_at is None:
+                        first_token_at = time.time()
+                    chunks += 1
+                    parts.append(text)
+                    printer.feed(text)
+        printer.flush()
+
+        if first_token_at is not None:
+            generation_time = time.time() - first_token_at
+            tokens = (usage or {}).get("completion_tokens") or chunks
+            tokens_per_sec = tokens / generation_time if generation_time > 0 else 0.0
+            self.engine.on_stream_stats(self.thread_id, first_token_at - start_time, tokens_per_sec)
+        return "".join(parts), usage
+
+    def _record_usage(self, api_type, model, messages, content, usage):
+        """Account a reply's tokens; estimated when the provider sent no usage block"""
+        usage = usage or {}
+        prompt_tokens = usage.get("prompt_tokens")
+        if prompt_tokens is None:
+            prompt_tokens = sum(count_tokens(m["content"]) + MESSAGE_OVERHEAD for m in messages)
+        completion_tokens = usage.get("completion_tokens")
+        if completion_tokens is None:
+            completion_tokens = count_tokens(content)
+        provider = PROVIDER_NAMES[api_type]
+        cost = self.engine.usage.record(provider, model, self.account_id, prompt_tokens, completion_tokens,
+                                        self.label)
+        self.engine.metrics.usage(provider, prompt_tokens, completion_tokens, cost)
+        self.last_usage = (prompt_tokens, completion_tokens, cost)
+
+    def _record_turn(self, turn, provider, model, prompt, response, failed, prompt_tokens):
+        transcripts = self.engine.transcripts
+        history = self.engine.history
+        if transcripts is None and history is None:
+            return
+        completion_tokens = cost = None
+        if not failed and self.last_usage is not None:
+            prompt_tokens, completion_tokens, cost = self.last_usage
+        fields = dict(
+            thread_id=self.thread_id, account=self.label, turn=turn + 1,
+            provider=provider, model=model,
+            prompt_tokens=prompt_tokens, completion_tokens=completion_tokens, cost=cost,
+            latency=None if failed else self.last_latency,
+            status="error" if failed else "ok", ts=time.time(),
+        )
+        if history is not None:
+            history.record_turn(**fields)
+        if transcripts is not None:
+            transcripts.record(prompt=prompt, response=response, **fields)
+
+    async def facilitate_conversation(self):
+        tracer = self.engine.tracer
+        emit = tracer.wrap("emit", self.thread_id, self.engine.on_update)
+        proxy_info = f" через {self.account.proxy[:20]}..." if self.account.proxy else ""
+
+        emit(self.thread_id, f"👤 Аккаунт: {self.label}{proxy_info}")
+        emit(self.thread_id, f"💬 Стартовый промпт: {self.account.prompt}\n")
+
+        context = ContextBuilder(SYSTEM_PREAMBLE, compact=self.engine.compact_context)
+        context.add("user", self.account.prompt)
+        # What the next turn answers: the starting prompt, then the opponent's last reply
+        turn_input = self.account.prompt
+
+        providers = {
+            "nousresearch": ("NousResearch", self.account.nous_key, self.nous_model, "openrouter"),
+            "openrouter": ("OpenRouter", self.account.openrouter_key, self.or_model, "nousresearch"),
+        }
+        current_api = "nousresearch"
+        success = True
+        checked = self.engine.proxy_checker.cached(self.account.proxy) if self.account.proxy else None
+        if checked is not None and not checked.ok:
+            emit(self.thread_id, f"❌ Прокси не прошёл проверку: {checked.message}")
+            success = False
+
+        for turn in range(self.turns):
+            if not success or not self.running:
+                break
+            cap = self.engine.usage.cap_reached(self.account_id)
+            if cap:
+                emit(self.thread_id, f"💰 Остановлено: {cap}")
+                success = False
+                break
+
+            self.engine.on_progress(self.thread_id, int((turn / self.turns) * 100))
+
+            turn_started = time.monotonic()
+            try:
+                name, api_key, model, next_api = providers[current_api]
+                msgs, prompt_tokens = context.build(self.engine.context_budget_for(model))
+                emit(self.thread_id, f"\n🔄 Раунд {turn + 1}/{self.turns} · контекст {prompt_tokens} ток.")
+                if not api_key:
+                    emit(self.thread_id, f"❌ Нет API ключа для {current_api}")
+                    success = False
+                    break
+
+                self.engine.prompt_tokens += prompt_tokens
+                if self.engine.streaming:
+                    emit(self.thread_id, f"🤖 {name}:")
+                    response = await self.query_api(msgs, current_api, api_key, model, self.account.proxy,
+                                                    on_text=lambda text: emit(self.thread_id, text))
+                else:
+                    response = await self.query_api(msgs, current_api, api_key, model, self.account.proxy)
+                failed = "Ошибка:" in response
+                self.engine.metrics.turn(name, not failed)
+                self._record_turn(turn, name, model, turn_input, response, failed, prompt_tokens)
+                if failed:
+                    emit(self.thread_id, f"❌ Ошибка {name}: {response}")
+                    success = False
+                    break
+                if not self.engine.streaming:
+                    emit(self.thread_id, f"🤖 {name}:\n{response}\n")
+                used_prompt, used_completion, cost = self.last_usage
+                emit(self.thread_id, f"💰 {used_prompt} + {used_completion} ток., ${cost:.4f}")
+                turn_input = response.strip()
+                context.add("assistant", turn_input)
+                context.add("user", FOLLOWUP_USER_PROMPT)
+                current_api = next_api
+
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                emit(self.thread_id, f"💥 Критическая ошибка: {str(e)}")
+                success = False
+                break
+            finally:
+                tracer.add("turn", self.thread_id, turn_started, turn=turn + 1)
+
+        if success:
+            emit(self.thread_id, f"\n✅ Успешно завершено!")
+        else:
+            emit(self.thread_id, f"\n❌ Провал!")
+
+        self.engine.on_progress(self.thread_id, 100)
+        self.engine.on_finished(self.thread_id, success)
+        return success
+
+# =============================
+# Engine
+# =============================
+
+class ConversationEngine:
+    """Runs conversations as coroutines on one background event loop.
+
+    Submitted conversations wait in a FIFO work queue and are picked up by a
+    pool of ``max_concurrency`` worker coroutines; the pool can be resized
+    while a run is in progress.  ``submit``, ``set_max_concurrency`` and
+    ``stop_all`` are safe to call from any thread.  The callbacks are invoked
+    on the engine thread, so frontends must marshal them to their own thread
+    (the Qt bridge does this with queued signals).
+    """
+
+    def __init__(self, max_concurrency=3):
+        self.max_concurrency = max_concurrency
+        self.on_update = _noop
+        self.on_progress = _noop
+        self.on_finished = _noop
+        self.on_stats = _noop
+        self.on_stream_stats = _noop
+        self.streaming = False
+        self.transcripts = None
+        self.history = None  # run-history sink with record_turn(**fields), e.g. ConfigStore
+        self.endpoints = {"nousresearch": NOUS_API_URL, "openrouter": OPENROUTER_API_URL}
+        self.request_timeout = REQUEST_TIMEOUT
+        self.conversations = {}
+        self.state_counts = dict.fromkeys(STATES, 0)
+        self.session_pool = SessionPool()
+        self.latency = LatencyStats()
+        self.metrics = EngineMetrics()
+        self.tracer = Tracer()
+        self.session_pool.stats.tracer = self.tracer
+        self.rate_governor = RateGovernor(max_concurrency)
+        self.retry_policies = {api_type: RetryPolicy() for api_type in PROVIDER_NAMES}
+        self.timing = RunTiming()
+        self.breakers = BreakerRegistry()
+        self.context_budget = DEFAULT_CONTEXT_BUDGET
+        self.context_budgets = {}  # model -> prompt token budget, overrides context_budget
+        self.compact_context = False
+        self.prompt_tokens = 0
+        self.usage = UsageLedger()
+        self.proxy_checker = ProxyChecker(self.session_pool)
+        self._loop = None
+        self._thread = None
+        self._queue = None
+        self._workers = set()
+        self._idle_workers = set()
+        self._warm_up = None
+
+    def start(self):
+        """Start the event loop thread and the worker pool if not running yet."""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._loop = asyncio.new_event_loop()
+        self._queue = None
+        self._workers = set()
+        self._idle_workers = set()
+        self._thread = threading.Thread(target=self._run_loop, name="ConversationEngine", daemon=True)
+        self._thread.start()
+        self._loop.call_soon_threadsafe(self._resize_pool)
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_forever()
+
+    def set_max_concurrency(self, value):
+        """Resize the worker pool; running conversations are never interrupted."""
+        self.max_concurrency = max(1, int(value))
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._resize_pool)
+
+    def _resize_pool(self):
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+        self.rate_governor.configure(max_concurrency=self.max_concurrency)
+        while len(self._workers) < self.max_concurrency:
+            self._workers.add(self._loop.create_task(self._worker()))
+        # Idle surplus workers go now; busy ones leave after their conversation
+        surplus = len(self._workers) - self.max_concurrency
+        for task in list(self._idle_workers)[:max(0, surplus)]:
+            self._workers.discard(task)
+            self._idle_workers.discard(task)
+            task.cancel()
+
+    async def _worker(self):
+        task = asyncio.current_task()
+        try:
+            while task in self._workers and len(self._workers) <= self.max_concurrency:
+                self._idle_workers.add(task)
+                try:
+                    conversation = await self._queue.get()
+                finally:
+                    self._idle_workers.discard(task)
+                await self._run(conversation)
+        finally:
+            self._workers.discard(task)
+
+    def _set_state(self, conversation, state):
+        self.state_counts[conversation.state] -= 1
+        self.state_counts[state] += 1
+        now = time.monotonic()
+        if state == RUNNING:
+            conversation.started_at = now
+            self.tracer.add("queue", conversation.thread_id, conversation.queued_at, now)
+        elif state != QUEUED:
+            started_at = conversation.started_at
+            self.metrics.conversation_finished(state, now - started_at if started_at else 0.0)
+            if started_at:
+                self.tracer.add("conversation", conversation.thread_id, started_at, now, state=state)
+        conversation.state = state
+
+    def metrics_text(self):
+        """Current metrics in the Prometheus text format; safe from any thread."""
+        return self.metrics.render(self.state_counts, self.max_concurrency)
+
+    def configure_pool(self, pool_size=None, idle_timeout=None):
+        self.session_pool.configure(pool_size, idle_timeout)
+
+    def configure_rate_limits(self, key_rpm):
+        """Requests per minute per API key; 0 keeps the provider defaults."""
+        if self._loop is not None and self._loop.is_running():
+            self._loop.call_soon_threadsafe(self.rate_governor.configure, key_rpm)
+        else:
+            self.rate_governor.configure(key_rpm)
+
+    def configure_breakers(self, error_rate=None, cooldown=None):
+        """Error rate (0-1) that opens a breaker and seconds before it probes again."""
+        if self._loop is not None and self._loop.is_running():
+            self._loop.call_soon_threadsafe(self.breakers.configure, error_rate, cooldown)
+        else:
+            self.breakers.configure(error_rate, cooldown)
+
+    def configure_context(self, budget=None, compact=None, budgets=None):
+        """Prompt token budget (default and per model) and compaction of older turns."""
+        if budget is not None:
+            self.context_budget = max(1, int(budget))
+        if compact is not None:
+            self.compact_context = bool(compact)
+        if budgets is not None:
+            self.context_budgets = {model: int(tokens) for model, tokens in budgets.items()}
+
+    def configure_proxy_checks(self, test_url=None, concurrency=None, ttl=None):
+        if self._loop is not None and self._loop.is_running():
+            self._loop.call_soon_threadsafe(self.proxy_checker.configure, test_url, concurrency, ttl)
+        else:
+            self.proxy_checker.configure(test_url, concurrency, ttl)
+
+    def check_proxies(self, proxies, on_result, use_cache=True):
+        """Check proxies on the engine loop; ``on_result`` is called there per proxy.
+
+        Returns a concurrent.futures.Future of the list of results.
+        """
+        self.start()
+        return asyncio.run_coroutine_threadsafe(
+            self.proxy_checker.check_many(proxies, format_proxy, on_result, use_cache), self._loop)
+
+    def configure_usage(self, prices=None, run_tokens=None, run_cost=None, account_tokens=None, account_cost=None):
+        """Price table (model -> [prompt, completion] USD per 1M tokens) and budget caps (0 = none)."""
+        if prices:
+            self.usage.set_prices(prices)
+        self.usage.configure_caps(run_tokens, run_cost, account_tokens, account_cost)
+
+    def context_budget_for(self, model):
+        return self.context_budgets.get(model, self.context_budget)
+
+    def configure_retries(self, max_attempts=None, deadline=None, policies=None):
+        """Apply attempts / per-turn deadline (seconds, 0 = none) to every provider.
+
+        ``policies`` maps a provider ("nousresearch", "openrouter") to RetryPolicy
+        settings that override the shared ones, e.g. {"openrouter": {"backoff_base":
+        2, "retry_statuses": [500, 502]}}; passing it rebuilds every policy.
+        """
+        if policies is not None:
+            self.retry_policies = {api_type: RetryPolicy() for api_type in PROVIDER_NAMES}
+        for api_type, policy in self.retry_policies.items():
+            policy.configure(max_attempts, deadline)
+            if policies and api_type in policies:
+                policy.override(policies[api_type])
+
+    def connection_stats(self):
+        return self.session_pool.stats
+
+    def configure_tracing(self, enabled):
+        """Record per-turn spans into ``tracer`` from the next run on."""
+        self.tracer.enabled = bool(enabled)
+
+    def call_on_loop(self, fn, *args):
+        """Run ``fn`` on the engine thread; returns a concurrent.futures.Future of its result."""
+        self.start()
+        future = concurrent.futures.Future()
+
+        def call():
+            try:
+                future.set_result(fn(*args))
+            except Exception as e:
+                future.set_exception(e)
+
+        self._loop.call_soon_threadsafe(call)
+        return future
+
+    def begin_run(self):
+        """Reset per-run counters before a new batch is dispatched."""
+        self.session_pool.stats.reset()
+        self.latency.reset()
+        self.rate_governor.reset()
+        self.timing.reset()
+        self.breakers.reset()
+        self.prompt_tokens = 0
+        self.usage.reset()
+        self.tracer.reset()
+        for state in (DONE, FAILED, CANCELLED):
+            self.state_counts[state] = 0
+
+    def warm_up(self, accounts):
+        """Pre-connect to every (provider, proxy) the accounts will use.
+
+        Conversations submitted afterwards wait for the warm-up to finish
+        before their first request, so the GUI thread never blocks on it.
+        """
+        targets = {}
+        for account in accounts:
+            proxy = format_proxy(account.proxy) if account.proxy else None
+            for url, key in ((self.endpoints["nousresearch"], account.nous_key),
+                             (self.endpoints["openrouter"], account.openrouter_key)):
+                if key:
+                    targets[(url, proxy)] = targets.get((url, proxy), 0) + 1
+        if not targets:
+            return
+        self.start()
+        self._warm_up = asyncio.run_coroutine_threadsafe(self._run_warm_up(targets), self._loop)
+
+    async def _run_warm_up(self, targets):
+        await self.session_pool.warm_up(targets)
+
+    def submit(self, account, turns, thread_id, delay_range=(1, 3),
+               nous_model=DEFAULT_NOUS_MODEL, or_model=DEFAULT_OPENROUTER_MODEL):
+        """Queue a conversation; returns a concurrent.futures.Future of its success."""
+        self.start()
+        conversation = Conversation(self, account, turns, thread_id, delay_range, nous_model, or_model)
+        self.conversations[thread_id] = conversation
+        self._loop.call_soon_threadsafe(self._enqueue, conversation)
+        return conversation.future
+
+    def _enqueue(self, conversation):
+        self.state_counts[QUEUED] += 1
+        conversation.queued_at = time.monotonic()
+        self._queue.put_nowait(conversation)
+
+    def _finish_unstarted(self, conversation, state, message):
+        self.on_update(conversation.thread_id, message)
+        self._set_state(conversation, state)
+        self.conversations.pop(conversation.thread_id, None)
+        self.on_progress(conversation.thread_id, 100)
+        self.on_finished(conversation.thread_id, False)
+        conversation.future.set_result(False)
+
+    def _requeue(self, conversation):
+        if conversation.state == QUEUED:
+            self._queue.put_nowait(conversation)
+
+    async def _run(self, conversation):
+        if conversation.state == CANCELLED:
+            return
+        wait = self.breakers.retry_in(conversation.endpoints())
+        if wait > 0:
+            now = time.monotonic()
+            if conversation.deferred_since is None:
+                conversation.deferred_since = now
+                self.on_update(conversation.thread_id, f"⏸️ Провайдер недоступен, ожидание {wait:.0f} с")
+            if now - conversation.deferred_since < MAX_BREAKER_WAIT:
+                # Keep it queued until the breaker probes again; the worker moves on
+                self._loop.call_later(wait, self._requeue, conversation)
+                return
+            self._finish_unstarted(conversation, FAILED, f"❌ {BREAKER_ERROR}")
+            return
+        cap = self.usage.cap_reached(conversation.account_id)
+        if cap:
+            self._finish_unstarted(conversation, CANCELLED, f"💰 Не запущено: {cap}")
+            return
+        self._set_state(conversation, RUNNING)
+        # A task of its own, so stop() can cancel the conversation without taking the worker down
+        task = conversation.task = self._loop.create_task(self._converse(conversation))
+        try:
+            await asyncio.wait({task})
+        except asyncio.CancelledError:
+            task.cancel()
+            self._set_state(conversation, FAILED)
+            conversation.future.set_result(False)
+            raise
+        finally:
+            self.conversations.pop(conversation.thread_id, None)
+        if task.cancelled():
+            # Stopped by the user: not counted as a failure of the account
+            self.on_update(conversation.thread_id, "⏹️ Остановлено")
+            self._set_state(conversation, CANCELLED)
+            conversation.future.set_result(False)
+        elif task.exception() is not None:
+            # A bug outside the per-turn handler: report it like any failed conversation
+            exc = task.exception()
+            print("".join(traceback.format_exception(type(exc), exc, exc.__traceback__)), file=sys.stderr)
+            self.on_update(conversation.thread_id, f"💥 Критическая ошибка: {exc}")
+            self._set_state(conversation, FAILED)
+            self.on_progress(conversation.thread_id, 100)
+            self.on_finished(conversation.thread_id, False)
+            conversation.future.set_exception(exc)
+        else:
+            success = task.result()
+            self._set_state(conversation, DONE if success else FAILED)
+            conversation.future.set_result(success)
+
+    async def _converse(self, conversation):
+        if self._warm_up is not None and not self._warm_up.done():
+            # Shielded: cancelling one conversation must not cancel the shared warm-up
+            await asyncio.shield(asyncio.wrap_future(self._warm_up))
+        return await conversation.facilitate_conversation()
+
+    def stop_all(self):
+        """Drop queued conversations and cancel running ones mid-request.
+
+        Never blocks.  Returns a concurrent.futures.Future of (seconds until
+        the cancelled conversations finished, how many were still running
+        after STOP_TIMEOUT).
+        """
+        drained = concurrent.futures.Future()
+        if self._loop is not None and self._loop.is_running():
+            self._loop.call_soon_threadsafe(self._stop_all, drained)
+        else:
+            self._stop_all()
+            drained.set_result((0.0, 0))
+        return drained
+
+    def _stop_all(self, drained=None):
+        started = time.monotonic()
+        running = []
+        for conversation in list(self.conversations.values()):
+            conversation.stop()
+            if conversation.state == QUEUED:
+                self._set_state(conversation, CANCELLED)
+                conversation.future.set_result(False)
+                self.conversations.pop(conversation.thread_id, None)
+            elif conversation.state == RUNNING:
+                running.append(conversation)
+        if drained is not None:
+            self._loop.create_task(self._report_drained(running, started, drained))
+
+    async def _report_drained(self, running, started, drained):
+        pending = set()
+        if running:
+            _, pending = await asyncio.wait([asyncio.wrap_future(c.future) for c in running],
+                                            timeout=STOP_TIMEOUT)
+        drained.set_result((time.monotonic() - started, len(pending)))
+
+    def active_count(self):
+        return self.state_counts[RUNNING]
+
+    def queued_count(self):
+        return self.state_counts[QUEUED]
+
+    def shutdown(self, timeout=5):
+        """Stop conversations, close the HTTP session and the loop thread."""
+        self.stop_all()
+        if self._loop is None or not self._loop.is_running():
+            return
+        future = asyncio.run_coroutine_threadsafe(self._close(), self._loop)
+        try:
+            future.result(timeout)
+        except Exception:
+            pass
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout)
+
+    async def _close(self):
+        tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await self.session_pool.close()
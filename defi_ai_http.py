@@ -0,0 +1,140 @@
+"""HTTP plumbing shared by the conversation engine.
+
+``SessionPool`` keeps one keep-alive ``aiohttp.ClientSession`` per
+(provider base URL, proxy) pair so consecutive turns reuse TCP+TLS
+connections instead of handshaking on every request.  Sessions are lent
+out with ``with pool.session(url, proxy) as session:``; one idle for longer
+than ``idle_timeout`` is closed, but never while a request (a long reply or
+an SSE stream) still reads from it.  All methods must be called on the
+engine's event loop.
+"""
+
+import asyncio
+import time
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+import aiohttp
+
+DEFAULT_POOL_SIZE = 10
+DEFAULT_IDLE_TIMEOUT = 60.0
+WARM_UP_TIMEOUT = 5
+
+
+def base_url(url):
+    """scheme://host[:port] part of a URL, used as the pool key."""
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}"
+
+
+class ConnectionStats:
+    """Connections opened vs. reused, fed by aiohttp trace hooks.
+
+    With a ``tracer`` set, new connections of requests made with a
+    ``trace_request_ctx`` (the conversation's thread id) become "connect" spans.
+    """
+
+    def __init__(self):
+        self.opened = 0
+        self.reused = 0
+        self.tracer = None
+
+    def reset(self):
+        self.opened = 0
+        self.reused = 0
+
+    def trace_config(self):
+        trace = aiohttp.TraceConfig()
+        trace.on_connection_create_start.append(self._on_create_start)
+        trace.on_connection_create_end.append(self._on_create)
+        trace.on_connection_reuseconn.append(self._on_reuse)
+        return trace
+
+    async def _on_create_start(self, session, ctx, params):
+        ctx.connect_started = time.monotonic()
+
+    async def _on_create(self, session, ctx, params):
+        self.opened += 1
+        if self.tracer is not None and ctx.trace_request_ctx is not None:
+            self.tracer.add("connect", ctx.trace_request_ctx, ctx.connect_started)
+
+    async def _on_reuse(self, session, ctx, params):
+        self.reused += 1
+
+    def __str__(self):
+        return f"Соединения: открыто {self.opened} / переиспользовано {self.reused}"
+
+
+class SessionPool:
+    """Keep-alive sessions keyed by (base URL, proxy) with idle eviction."""
+
+    def __init__(self, pool_size=DEFAULT_POOL_SIZE, idle_timeout=DEFAULT_IDLE_TIMEOUT):
+        self.pool_size = pool_size
+        self.idle_timeout = idle_timeout
+        self.stats = ConnectionStats()
+        self._sessions = {}  # (base_url, proxy) -> [session, last_used, requests in flight]
+
+    def configure(self, pool_size=None, idle_timeout=None):
+        """New limits apply to sessions created after the call."""
+        if pool_size is not None:
+            self.pool_size = max(1, int(pool_size))
+        if idle_timeout is not None:
+            self.idle_timeout = max(1.0, float(idle_timeout))
+
+    @contextmanager
+    def session(self, url, proxy=None):
+        """Session for the host of ``url`` reached through ``proxy``, kept open until the block exits."""
+        entry = self._entry(url, proxy)
+        entry[2] += 1
+        try:
+            yield entry[0]
+        finally:
+            entry[2] -= 1
+            entry[1] = time.monotonic()
+
+    def _entry(self, url, proxy):
+        now = time.monotonic()
+        self._evict_idle(now)
+        key = (base_url(url), proxy)
+        entry = self._sessions.get(key)
+        if entry is None or entry[0].closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.pool_size,
+                limit_per_host=self.pool_size,
+                keepalive_timeout=self.idle_timeout,
+                ttl_dns_cache=300,
+            )
+            session = aiohttp.ClientSession(connector=connector, trace_configs=[self.stats.trace_config()])
+            entry = self._sessions[key] = [session, now, 0]
+        entry[1] = now
+        return entry
+
+    def _evict_idle(self, now):
+        for key, (session, last_used, in_flight) in list(self._sessions.items()):
+            if not in_flight and now - last_used > self.idle_timeout:
+                del self._sessions[key]
+                asyncio.ensure_future(session.close())
+
+    async def warm_up(self, targets):
+        """Resolve DNS and open connections before the first turn.
+
+        ``targets`` maps (url, proxy) to the number of connections worth
+        opening, which is capped at the pool size.  Failures are ignored: a
+        cold connection is still opened by the real request later.
+        """
+        requests = []
+        for (url, proxy), count in targets.items():
+            for _ in range(min(count, self.pool_size)):
+                requests.append(self._touch(url, proxy))
+        await asyncio.gather(*requests, return_exceptions=True)
+
+    async def _touch(self, url, proxy):
+        with self.session(url, proxy) as session:
+            async with session.head(base_url(url) + "/", proxy=proxy, allow_redirects=False,
+                                    timeout=aiohttp.ClientTimeout(total=WARM_UP_TIMEOUT)) as response:
+                await response.read()
+
+    async def close(self):
+        sessions = [session for session, _, _ in self._sessions.values()]
+        self._sessions.clear()
+        await asyncio.gather(*(s.close() for s in sessions), return_exceptions=True)
@@ -0,0 +1,231 @@
+"""Run metrics in the Prometheus text exposition format.
+
+``EngineMetrics`` holds counters that only ever grow, so a scraper sees
+correct rates across runs.  They cover finished conversations, turns and
+requests per provider, HTTP status codes, retries, tokens, cost and busy
+worker time, plus a coarse latency histogram per provider.  The engine
+thread updates them; each update is a dict lookup and an integer add, with
+no lock.  ``render`` may run on any thread.  It copies each dict before
+walking it, which is atomic under the GIL.
+
+``MetricsExporter`` publishes the text in two ways.  One is a
+``/metrics`` endpoint on 127.0.0.1, served by a stdlib HTTP server thread.
+The other is a file rewritten atomically every few seconds, in the format
+node_exporter's textfile collector reads.  Both are optional.
+"""
+
+import os
+import threading
+import time
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_METRICS_INTERVAL = 15.0
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Upper bounds in seconds of the request latency histogram
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.0, 4.0, 8.0, 15.0, 30.0, 60.0)
+
+PREFIX = "defi_ai_"
+
+
+def _labels(**labels):
+    if not labels:
+        return ""
+    parts = []
+    for name, value in labels.items():
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        parts.append(f'{name}="{value}"')
+    return "{" + ",".join(parts) + "}"
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class EngineMetrics:
+    """Counters for the whole lifetime of an engine, fed on the engine thread."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.started_at = time.time()
+        self.buckets = tuple(buckets)
+        self.conversations = {}  # final state -> count
+        self.turns = {}  # (provider, "ok" | "error") -> count
+        self.requests = {}  # (provider, HTTP status or error kind) -> count
+        self.retries = {}  # (provider, "backoff" | "rate_limited") -> count
+        self.tokens = {}  # (provider, "prompt" | "completion") -> count
+        self.cost = {}  # provider -> USD
+        self.latency = {}  # provider -> [bucket counts..., +Inf count, count, sum]
+        self.busy_seconds = 0.0
+
+    def conversation_finished(self, state, seconds=0.0):
+        self.conversations[state] = self.conversations.get(state, 0) + 1
+        self.busy_seconds += seconds
+
+    def turn(self, provider, ok):
+        key = (provider, "ok" if ok else "error")
+        self.turns[key] = self.turns.get(key, 0) + 1
+
+    def request(self, provider, code, seconds):
+        """One HTTP attempt; ``code`` is the status or an error kind such as "timeout"."""
+        key = (provider, code)
+        self.requests[key] = self.requests.get(key, 0) + 1
+        series = self.latency.get(provider)
+        if series is None:
+            series = self.latency[provider] = [0] * (len(self.buckets) + 3)
+        series[bisect_left(self.buckets, seconds)] += 1
+        series[-2] += 1
+        series[-1] += seconds
+
+    def retry(self, provider, reason):
+        key = (provider, reason)
+        self.retries[key] = self.retries.get(key, 0) + 1
+
+    def usage(self, provider, prompt_tokens, completion_tokens, cost):
+        for kind, tokens in (("prompt", prompt_tokens), ("completion", completion_tokens)):
+            key = (provider, kind)
+            self.tokens[key] = self.tokens.get(key, 0) + tokens
+        self.cost[provider] = self.cost.get(provider, 0.0) + cost
+
+    def render(self, states, workers):
+        """Exposition text; ``states`` maps conversation state to its current count."""
+        lines = []
+
+        def family(name, kind, help_text, samples):
+            lines.append(f"# HELP {PREFIX}{name} {help_text}")
+            lines.append(f"# TYPE {PREFIX}{name} {kind}")
+            for suffix, labels, value in samples:
+                lines.append(f"{PREFIX}{name}{suffix}{_labels(**labels)} {_number(value)}")
+
+        states = dict(states)
+        family("conversations", "gauge", "Conversations by current state.",
+               [("", {"state": state}, count) for state, count in states.items()])
+        family("conversations_finished_total", "counter", "Conversations that reached a final state.",
+               [("", {"state": state}, count) for state, count in sorted(dict(self.conversations).items())])
+        family("turns_total", "counter", "Conversation turns by provider and outcome.",
+               [("", {"provider": p, "status": s}, count) for (p, s), count in sorted(dict(self.turns).items())])
+        family("requests_total", "counter", "HTTP attempts by provider and status code or error kind.",
+               [("", {"provider": p, "code": c}, count)
+                for (p, c), count in sorted(dict(self.requests).items(), key=lambda item: str(item[0]))])
+        family("retries_total", "counter", "Repeated attempts by provider and reason.",
+               [("", {"provider": p, "reason": r}, count) for (p, r), count in sorted(dict(self.retries).items())])
+        family("tokens_total", "counter", "Prompt and completion tokens by provider.",
+               [("", {"provider": p, "kind": k}, count) for (p, k), count in sorted(dict(self.tokens).items())])
+        family("cost_usd_total", "counter", "Estimated spend in USD by provider.",
+               [("", {"provider": p}, cost) for p, cost in sorted(dict(self.cost).items())])
+
+        samples = []
+        for provider, series in sorted(dict(self.latency).items()):
+            series = list(series)
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series):
+                cumulative += count
+                samples.append(("_bucket", {"provider": provider, "le": _number(bound)}, cumulative))
+            samples.append(("_count", {"provider": provider}, series[-2]))
+            samples.append(("_sum", {"provider": provider}, series[-1]))
+        family("request_duration_seconds", "histogram", "Duration of HTTP attempts by provider.", samples)
+
+        running = states.get("running", 0)
+        family("workers", "gauge", "Size of the worker pool.", [("", {}, workers)])
+        family("workers_busy", "gauge", "Workers running a conversation.", [("", {}, running)])
+        family("worker_utilisation", "gauge", "Busy workers as a fraction of the pool.",
+               [("", {}, running / workers if workers else 0.0)])
+        family("worker_busy_seconds_total", "counter", "Time workers spent running finished conversations.",
+               [("", {}, self.busy_seconds)])
+        family("uptime_seconds", "gauge", "Seconds since the engine was created.",
+               [("", {}, time.time() - self.started_at)])
+        return "\n".join(lines) + "\n"
+
+
+class MetricsExporter:
+    """Serves ``collect()`` on localhost and/or rewrites it to ``path`` periodically."""
+
+    def __init__(self, collect, port=0, path="", interval=DEFAULT_METRICS_INTERVAL, host="127.0.0.1"):
+        self.collect = collect
+        self.port = int(port or 0)
+        self.path = path or ""
+        self.interval = max(1.0, float(interval))
+        self.host = host
+        self.server = None
+        self._stop = threading.Event()
+        self._threads = []
+
+    @property
+    def enabled(self):
+        return bool(self.port or self.path)
+
+    def __str__(self):
+        targets = []
+        if self.port:
+            targets.append(f"http://{self.host}:{self.port}/metrics")
+        if self.path:
+            targets.append(f"{self.path} (каждые {self.interval:.0f} с)")
+        return ", ".join(targets) or "выключены"
+
+    def start(self):
+        """Start the configured outputs; raises OSError when the port is taken."""
+        self._stop.clear()
+        if self.port:
+            self.server = ThreadingHTTPServer((self.host, self.port), self._handler())
+            self.server.daemon_threads = True
+            self._spawn(self.server.serve_forever, "MetricsServer")
+        if self.path:
+            self._spawn(self._write_loop, "MetricsWriter")
+
+    def _spawn(self, target, name):
+        thread = threading.Thread(target=target, name=name, daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+    def _handler(self):
+        collect = self.collect
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = collect().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass  # scrapes every few seconds would flood the console
+
+        return Handler
+
+    def write_file(self):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(self.collect())
+        os.replace(tmp_path, self.path)
+
+    def _write_loop(self):
+        while True:
+            try:
+                self.write_file()
+            except OSError:
+                pass  # retried on the next tick
+            if self._stop.wait(self.interval):
+                return
+
+    def stop(self):
+        """Stop serving; the file gets a final rewrite."""
+        self._stop.set()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+        for thread in self._threads:
+            thread.join(2)
+        self._threads = []
+        if self.path:
+            try:
+                self.write_file()
+            except OSError:
+                pass
@@ -0,0 +1,123 @@
+"""Prompt library backed by an offset index into a memory-mapped file.
+
+Loading scans the file once.  It records the byte range of every distinct,
+non-empty prompt line; duplicates are detected by the line's 64-bit hash.
+Prompts are only decoded when they are looked up, so a multi-megabyte file
+costs about 12 bytes of index per prompt plus the shared page cache.
+``ShuffleBag`` hands out every prompt once in random order before any of
+them repeats.
+"""
+
+import mmap
+import random
+from array import array
+
+MAX_PROMPT_CHARS = 280
+
+
+class ShuffleBag:
+    """Indices 0..size-1 in random order; reshuffled once all have been drawn."""
+
+    def __init__(self, size, rng=None):
+        self.size = size
+        self.rng = rng or random.Random()
+        self._order = array("I")
+        self._next = 0
+
+    def draw(self):
+        if self._next >= len(self._order):
+            self._order = array("I", range(self.size))
+            self.rng.shuffle(self._order)
+            self._next = 0
+        index = self._order[self._next]
+        self._next += 1
+        return index
+
+
+class PromptLibrary:
+    """Distinct prompts of a text file (one per line) or of an in-memory list."""
+
+    def __init__(self, buffer, max_chars=MAX_PROMPT_CHARS, path=None, rng=None):
+        self.path = path
+        self.max_chars = max_chars
+        self.skipped_long = 0
+        self.duplicates = 0
+        self._buffer = buffer
+        self._starts = array("Q")
+        self._lengths = array("I")
+        self._scan()
+        self._bag = ShuffleBag(len(self), rng)
+
+    @classmethod
+    def from_file(cls, path, max_chars=MAX_PROMPT_CHARS):
+        """Map ``path`` read-only; raises OSError when it cannot be opened."""
+        with open(path, "rb") as f:
+            try:
+                buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:  # empty file
+                buffer = b""
+        return cls(buffer, max_chars, path)
+
+    @classmethod
+    def from_prompts(cls, prompts, max_chars=MAX_PROMPT_CHARS):
+        return cls("\n".join(prompts).encode("utf-8"), max_chars)
+
+    def _scan(self):
+        seen = set()
+        starts = self._starts
+        lengths = self._lengths
+        max_chars = self.max_chars
+        buffer = self._buffer
+        find = buffer.find
+        size = len(buffer)
+        pos = 0
+        while pos < size:
+            end = find(b"\n", pos)
+            if end < 0:
+                end = size
+            raw = buffer[pos:end]
+            line = raw.strip()
+            start = pos + len(raw) - len(raw.lstrip())
+            pos = end + 1
+            if not line:
+                continue
+            # Characters never outnumber bytes: only long lines need decoding
+            if len(line) > max_chars and len(line.decode("utf-8", "replace")) > max_chars:
+                self.skipped_long += 1
+                continue
+            digest = hash(line)
+            if digest in seen:
+                self.duplicates += 1
+                continue
+            seen.add(digest)
+            starts.append(start)
+            lengths.append(len(line))
+
+    def __len__(self):
+        return len(self._starts)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        start = self._starts[index]
+        return self._buffer[start:start + self._lengths[index]].decode("utf-8", "replace")
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def draw(self):
+        """Next prompt of the shuffle bag: no repeats until every prompt was used."""
+        return self[self._bag.draw()]
+
+    def close(self):
+        if isinstance(self._buffer, mmap.mmap):
+            self._buffer.close()
+
+    def summary(self):
+        parts = [f"{len(self)} промптов"]
+        if self.duplicates:
+            parts.append(f"дубликатов пропущено: {self.duplicates}")
+        if self.skipped_long:
+            parts.append(f"длиннее {self.max_chars} симв. пропущено: {self.skipped_long}")
+        return ", ".join(parts)
@@ -0,0 +1,117 @@
+"""Proxy connectivity checks with bounded concurrency and a TTL cache.
+
+``ProxyChecker`` fetches a test URL through each proxy on the engine's
+event loop, at most ``concurrency`` checks at a time, and keeps the result
+(with its latency) for ``ttl`` seconds.  The Proxy tab and the conversation
+engine read the same cache, so a proxy checked once is not checked again
+until its entry expires.  Point ``test_url`` at a local endpoint (the
+benchmark mock serves ``/ip``) to run checks without internet access.
+All coroutines must run on the engine's event loop.
+"""
+
+import asyncio
+import time
+
+import aiohttp
+
+DEFAULT_TEST_URL = "https://httpbin.org/ip"
+DEFAULT_CHECK_CONCURRENCY = 10
+DEFAULT_CACHE_TTL = 300.0
+CHECK_TIMEOUT = 15
+
+
+def proxy_host(proxy):
+    """host:port part of a host:port[:user:pass] proxy, safe to show in logs."""
+    return ":".join(proxy.split(":")[:2])
+
+
+class ProxyCheckResult:
+    """Outcome of one proxy check."""
+
+    __slots__ = ("proxy", "ok", "latency", "message", "checked_at")
+
+    def __init__(self, proxy, ok, latency, message, checked_at=None):
+        self.proxy = proxy
+        self.ok = ok
+        self.latency = latency
+        self.message = message
+        self.checked_at = time.time() if checked_at is None else checked_at
+
+
+class ProxyChecker:
+    """Bounded-concurrency proxy checker sharing a TTL result cache."""
+
+    def __init__(self, session_pool, test_url=DEFAULT_TEST_URL, concurrency=DEFAULT_CHECK_CONCURRENCY,
+                 ttl=DEFAULT_CACHE_TTL, timeout=CHECK_TIMEOUT):
+        self.session_pool = session_pool
+        self.test_url = test_url
+        self.concurrency = concurrency
+        self.ttl = ttl
+        self.timeout = timeout
+        self.cache = {}  # proxy -> ProxyCheckResult
+        self._semaphore = None
+        self._semaphore_size = None
+
+    def configure(self, test_url=None, concurrency=None, ttl=None):
+        if test_url:
+            if test_url != self.test_url:
+                self.cache.clear()
+            self.test_url = test_url
+        if concurrency is not None:
+            self.concurrency = max(1, int(concurrency))
+        if ttl is not None:
+            self.ttl = max(0.0, float(ttl))
+
+    def cached(self, proxy):
+        """Fresh cached result for ``proxy`` or None."""
+        result = self.cache.get(proxy)
+        if result is None or time.time() - result.checked_at > self.ttl:
+            return None
+        return result
+
+    async def check(self, proxy, formatted_proxy, use_cache=True):
+        """Check one proxy (``formatted_proxy`` is its http:// URL form)."""
+        if use_cache:
+            result = self.cached(proxy)
+            if result is not None:
+                return result
+        if self._semaphore is None or self._semaphore_size != self.concurrency:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+            self._semaphore_size = self.concurrency
+        async with self._semaphore:
+            result = await self._fetch(proxy, formatted_proxy)
+        self.cache[proxy] = result
+        return result
+
+    async def _fetch(self, proxy, formatted_proxy):
+        start_time = time.time()
+        try:
+            with self.session_pool.session(self.test_url, formatted_proxy) as session:
+                async with session.get(self.test_url, proxy=formatted_proxy,
+                                       timeout=aiohttp.ClientTimeout(total=self.timeout)) as response:
+                    latency = time.time() - start_time
+                    if response.status != 200:
+                        return ProxyCheckResult(proxy, False, latency, f"✗ Ошибка HTTP: {response.status}")
+                    try:
+                        origin = (await response.json(content_type=None)).get("origin", "Unknown")
+                    except (ValueError, AttributeError):
+                        origin = "Unknown"
+                    return ProxyCheckResult(proxy, True, latency,
+                                            f"✓ Работает ({latency:.2f} сек) - IP: {origin}")
+        except asyncio.CancelledError:
+            raise
+        except asyncio.TimeoutError:
+            return ProxyCheckResult(proxy, False, None, "✗ Таймаут соединения")
+        except aiohttp.ClientConnectionError:
+            return ProxyCheckResult(proxy, False, None, "✗ Ошибка подключения")
+        except Exception as e:
+            return ProxyCheckResult(proxy, False, None, f"✗ Ошибка: {str(e)}")
+
+    async def check_many(self, proxies, format_proxy, on_result, use_cache=True):
+        """Check ``proxies`` concurrently (bounded); ``on_result`` gets each result as it lands."""
+        async def one(proxy):
+            result = await self.check(proxy, format_proxy(proxy), use_cache)
+            on_result(result)
+            return result
+
+        return await asyncio.gather(*(one(proxy) for proxy in dict.fromkeys(proxies)))
@@ -0,0 +1,238 @@
+"""Rate-limit governor shared by all conversations of an engine.
+
+Every request first takes a token from the bucket of its provider and from
+the bucket of its API key.  Buckets refill at the configured requests per
+minute and are pushed back by ``Retry-After`` / ``x-ratelimit-*`` headers, so
+a 429 makes the key wait instead of failing the conversation.  On top of the
+buckets an AIMD limit caps requests in flight: it halves on a 429 and grows
+by about one slot per window of successful requests, never above the
+engine's ``max_concurrency``.  All methods must be called on the engine's
+event loop.
+"""
+
+import asyncio
+import re
+import time
+from email.utils import parsedate_to_datetime
+
+# Requests per minute per API key and per provider (None = no provider cap).
+# OpenRouter documents 20 rpm for free models; Nous publishes no fixed limit,
+# so its default is a conservative guess that headers will correct.
+PROVIDER_LIMITS = {
+    "nousresearch": {"key_rpm": 60, "provider_rpm": None},
+    "openrouter": {"key_rpm": 20, "provider_rpm": None},
+}
+
+MAX_RATE_LIMIT_WAIT = 120.0
+
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+
+def parse_wait(value, now=None):
+    """Seconds to wait from a Retry-After or x-ratelimit-reset header value.
+
+    Accepts plain seconds, epoch seconds or milliseconds (OpenRouter),
+    durations like ``6m0s`` / ``20ms`` (OpenAI-style) and HTTP dates.
+    Returns None when the value cannot be parsed.
+    """
+    if value is None:
+        return None
+    value = value.strip()
+    now = time.time() if now is None else now
+    try:
+        number = float(value)
+    except ValueError:
+        parts = _DURATION_PART.findall(value)
+        if parts and "".join(n + u for n, u in parts) == value:
+            return sum(float(n) * _DURATION_UNITS[u] for n, u in parts)
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - now)
+        except (TypeError, ValueError):
+            return None
+    if number > 1e12:  # epoch milliseconds
+        return max(0.0, number / 1000.0 - now)
+    if number > 1e9:  # epoch seconds
+        return max(0.0, number - now)
+    return max(0.0, number)
+
+
+class TokenBucket:
+    """Requests-per-minute bucket that can be blocked until a point in time."""
+
+    def __init__(self, rpm):
+        self.rate = rpm / 60.0
+        self.capacity = max(1.0, rpm / 10.0)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now):
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def delay(self, now):
+        """Seconds until a token is available; 0 means take one now."""
+        if self.blocked_until > now:
+            return self.blocked_until - now
+        self._refill(now)
+        if self.tokens >= 1.0:
+            return 0.0
+        return (1.0 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1.0
+
+    def block(self, seconds, now):
+        """No tokens until ``now + seconds``; the bucket restarts empty."""
+        until = now + min(seconds, MAX_RATE_LIMIT_WAIT)
+        if until > self.blocked_until:
+            self.blocked_until = until
+            self.tokens = 0.0
+            self.updated = until
+
+
+class AdaptiveLimit:
+    """AIMD cap on requests in flight."""
+
+    def __init__(self, maximum):
+        self.maximum = max(1, int(maximum))
+        self.limit = float(self.maximum)
+        self.in_flight = 0
+        self.decreased_at = 0.0
+        self._condition = None
+
+    def set_maximum(self, maximum):
+        self.maximum = max(1, int(maximum))
+        self.limit = min(self.limit, self.maximum) if self.in_flight else float(self.maximum)
+        self._notify()
+
+    @property
+    def current(self):
+        return max(1, int(self.limit))
+
+    async def acquire(self):
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_flight < self.current)
+            self.in_flight += 1
+
+    def release(self):
+        self.in_flight -= 1
+        self._notify()
+
+    def on_success(self):
+        if self.limit < self.maximum:
+            self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+            self._notify()
+
+    def on_rate_limited(self, now, window):
+        # One decrease per window, so a burst of 429s from the same
+        # overload does not collapse the limit to 1.
+        if now - self.decreased_at >= window:
+            self.limit = max(1.0, self.limit / 2.0)
+            self.decreased_at = now
+
+    def _notify(self):
+        condition = self._condition
+        if condition is None:
+            return
+
+        async def notify():
+            async with condition:
+                condition.notify_all()
+
+        asyncio.ensure_future(notify())
+
+
+class RateGovernor:
+    """Token buckets per provider and per API key plus the adaptive in-flight limit."""
+
+    def __init__(self, max_concurrency=3, limits=None):
+        self.limits = {name: dict(values) for name, values in (limits or PROVIDER_LIMITS).items()}
+        self.key_rpm_override = 0
+        self.adaptive = AdaptiveLimit(max_concurrency)
+        self.rate_limited = 0
+        self._provider_buckets = {}
+        self._key_buckets = {}
+
+    def configure(self, key_rpm=None, max_concurrency=None):
+        """``key_rpm`` > 0 overrides the per-key default of every provider."""
+        if key_rpm is not None:
+            self.key_rpm_override = max(0, int(key_rpm))
+            self._key_buckets.clear()
+        if max_concurrency is not None:
+            self.adaptive.set_maximum(max_concurrency)
+
+    def reset(self):
+        self.rate_limited = 0
+
+    def _buckets(self, provider, api_key):
+        limits = self.limits.get(provider, {})
+        buckets = []
+        provider_rpm = limits.get("provider_rpm")
+        if provider_rpm:
+            bucket = self._provider_buckets.get(provider)
+            if bucket is None:
+                bucket = self._provider_buckets[provider] = TokenBucket(provider_rpm)
+            buckets.append(bucket)
+        key_rpm = self.key_rpm_override or limits.get("key_rpm")
+        if key_rpm:
+            bucket = self._key_buckets.get((provider, api_key))
+            if bucket is None:
+                bucket = self._key_buckets[(provider, api_key)] = TokenBucket(key_rpm)
+            buckets.append(bucket)
+        return buckets
+
+    async def acquire(self, provider, api_key):
+        """Wait for a token from every bucket, then for an in-flight slot."""
+        buckets = self._buckets(provider, api_key)
+        while True:
+            now = time.monotonic()
+            wait = max((bucket.delay(now) for bucket in buckets), default=0.0)
+            if wait <= 0:
+                break
+            await asyncio.sleep(wait)
+        for bucket in buckets:
+            bucket.take()
+        await self.adaptive.acquire()
+
+    def release(self):
+        self.adaptive.release()
+
+    def on_response(self, provider, api_key, headers):
+        """Success: grow the limit and honour an exhausted quota announced in headers."""
+        self.adaptive.on_success()
+        remaining = headers.get("x-ratelimit-remaining-requests", headers.get("x-ratelimit-remaining"))
+        if remaining is not None and remaining.strip() in ("0", "0.0"):
+            reset = headers.get("x-ratelimit-reset-requests", headers.get("x-ratelimit-reset"))
+            wait = parse_wait(reset)
+            if wait:
+                self._block(provider, api_key, wait)
+
+    def on_rate_limited(self, provider, api_key, headers):
+        """429: halve the in-flight limit and block the key; returns the wait in seconds."""
+        headers = headers or {}
+        wait = parse_wait(headers.get("Retry-After"))
+        if wait is None:
+            wait = parse_wait(headers.get("x-ratelimit-reset-requests", headers.get("x-ratelimit-reset")))
+        if wait is None:
+            wait = 60.0 / (self.key_rpm_override or self.limits.get(provider, {}).get("key_rpm") or 60)
+        self.rate_limited += 1
+        now = time.monotonic()
+        self.adaptive.on_rate_limited(now, window=max(1.0, wait))
+        return self._block(provider, api_key, wait)
+
+    def _block(self, provider, api_key, wait):
+        # The key's own bucket takes the penalty; the provider bucket only
+        # when there is no per-key limit to hold the request back.
+        buckets = self._buckets(provider, api_key)
+        if buckets:
+            buckets[-1].block(wait, time.monotonic())
+        return min(wait, MAX_RATE_LIMIT_WAIT)
+
+    def __str__(self):
+        return (f"Лимит параллельности: {self.adaptive.current}/{self.adaptive.maximum} | "
+                f"429: {self.rate_limited}")
@@ -0,0 +1,104 @@
+"""Retry policy and request pacing for provider calls.
+
+``RetryPolicy`` decides which failures are retried, how long to back off
+between attempts and how long a whole turn may take.  ``Pacer`` spaces one
+conversation's requests at a target rate: the time already spent waiting
+on the network counts towards the interval, so a slow reply is not followed
+by a full fixed pause.
+"""
+
+import asyncio
+import random
+import time
+
+import aiohttp
+
+RETRYABLE_STATUSES = frozenset({408, 409, 425, 500, 502, 503, 504})
+RETRYABLE_EXCEPTIONS = (asyncio.TimeoutError, aiohttp.ClientConnectionError, aiohttp.ClientPayloadError)
+
+# Settings a "retry_policies" config entry may override for one provider
+POLICY_SETTINGS = ("max_attempts", "backoff_base", "backoff_factor", "backoff_max", "jitter", "retry_statuses",
+                   "deadline")
+
+
+class RetryPolicy:
+    """Attempts, exponential backoff with jitter and an optional per-turn deadline."""
+
+    def __init__(self, max_attempts=3, backoff_base=1.0, backoff_factor=2.0, backoff_max=30.0,
+                 jitter=0.5, retry_statuses=RETRYABLE_STATUSES, retry_exceptions=RETRYABLE_EXCEPTIONS,
+                 deadline=None):
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_factor = backoff_factor
+        self.backoff_max = backoff_max
+        self.jitter = jitter
+        self.retry_statuses = frozenset(retry_statuses)
+        self.retry_exceptions = tuple(retry_exceptions)
+        self.deadline = deadline
+
+    def configure(self, max_attempts=None, deadline=None, backoff_base=None, backoff_factor=None,
+                  backoff_max=None, jitter=None, retry_statuses=None):
+        """``deadline`` of 0 removes the per-turn limit."""
+        if max_attempts is not None:
+            self.max_attempts = max(1, int(max_attempts))
+        if deadline is not None:
+            self.deadline = float(deadline) or None
+        if backoff_base is not None:
+            self.backoff_base = max(0.0, float(backoff_base))
+        if backoff_factor is not None:
+            self.backoff_factor = max(1.0, float(backoff_factor))
+        if backoff_max is not None:
+            self.backoff_max = max(0.0, float(backoff_max))
+        if jitter is not None:
+            self.jitter = min(1.0, max(0.0, float(jitter)))
+        if retry_statuses is not None:
+            self.retry_statuses = frozenset(int(status) for status in retry_statuses)
+
+    def override(self, settings):
+        """Apply a ``retry_policies`` config entry; settings not in POLICY_SETTINGS are ignored."""
+        self.configure(**{name: value for name, value in settings.items() if name in POLICY_SETTINGS})
+
+    def is_retryable(self, error):
+        if isinstance(error, aiohttp.ClientResponseError):
+            return error.status in self.retry_statuses
+        return isinstance(error, self.retry_exceptions)
+
+    def backoff(self, attempt):
+        """Pause after failed attempt number ``attempt`` (0-based), +/- ``jitter`` of it."""
+        delay = min(self.backoff_max, self.backoff_base * self.backoff_factor ** attempt)
+        return delay * random.uniform(1.0 - self.jitter, 1.0 + self.jitter)
+
+    def deadline_at(self, now=None):
+        """Monotonic time by which the turn must finish, or None."""
+        if not self.deadline:
+            return None
+        return (time.monotonic() if now is None else now) + self.deadline
+
+
+class Pacer:
+    """Spaces the start of consecutive requests by an interval drawn from ``interval_range``.
+
+    Equivalent to a target rate of 1 / interval requests per conversation.
+    """
+
+    def __init__(self, interval_range=(0, 0)):
+        self.interval_range = interval_range
+        self.next_at = None
+
+    def mark(self, now=None):
+        """Record that a request starts now; the next one may start one interval later."""
+        now = time.monotonic() if now is None else now
+        self.next_at = now + random.uniform(*self.interval_range)
+
+    def delay(self, now=None):
+        if self.next_at is None:
+            return 0.0
+        now = time.monotonic() if now is None else now
+        return max(0.0, self.next_at - now)
+
+    async def wait(self):
+        """Sleep until the next request may start; returns the seconds slept."""
+        delay = self.delay()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        return delay
@@ -0,0 +1,190 @@
+"""Latency and error statistics for DeFi AI Club runs.
+
+Histograms are log-bucketed with a fixed number of counters, so memory does
+not grow with the length of a run and percentiles are accurate to about half
+a bucket (~2.5% relative error).  ``LatencyStats`` is fed on the engine
+thread and may be read from any thread; readers get a consistent enough
+snapshot for display because every update is a handful of integer writes.
+"""
+
+import math
+import time
+from array import array
+
+
+def display_names(keys, labels):
+    """Display name of each key: its label, numbered when several keys share one."""
+    names = {}
+    seen = {}
+    for key in keys:
+        label = str(labels.get(key, key))
+        seen[label] = seen.get(label, 0) + 1
+        names[key] = label if seen[label] == 1 else f"{label} #{seen[label]}"
+    return names
+
+
+class LatencyHistogram:
+    """Fixed-memory histogram of durations in seconds."""
+
+    MIN_SECONDS = 0.001
+    GROWTH = 1.05
+    BUCKETS = 300  # 1 ms .. ~38 min
+
+    _LOG_GROWTH = math.log(GROWTH)
+
+    def __init__(self):
+        self.counts = array("Q", bytes(8 * self.BUCKETS))
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def record(self, seconds):
+        if seconds <= self.MIN_SECONDS:
+            index = 0
+        else:
+            index = min(int(math.log(seconds / self.MIN_SECONDS) / self._LOG_GROWTH), self.BUCKETS - 1)
+        self.counts[index] += 1
+        self.count += 1
+        self.total += seconds
+        if self.min is None or seconds < self.min:
+            self.min = seconds
+        if self.max is None or seconds > self.max:
+            self.max = seconds
+
+    def bucket_bounds(self):
+        """Upper bound in seconds of every bucket, for exposition formats."""
+        return [self.MIN_SECONDS * self.GROWTH ** (i + 1) for i in range(self.BUCKETS)]
+
+    def percentile(self, q):
+        """Approximate q-th percentile (0-100); None when empty."""
+        if not self.count:
+            return None
+        rank = max(1, math.ceil(self.count * q / 100.0))
+        seen = 0
+        for index, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if seen >= rank:
+                value = self.MIN_SECONDS * self.GROWTH ** (index + 0.5)
+                return min(max(value, self.min), self.max)
+        return self.max
+
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+
+class LatencySeries:
+    """Successful-request latencies plus error count for one key."""
+
+    def __init__(self):
+        self.histogram = LatencyHistogram()
+        self.errors = 0
+        self.first_at = None
+        self.last_at = None
+
+    def record(self, seconds, ok, now):
+        if self.first_at is None:
+            self.first_at = now
+        self.last_at = now
+        if ok:
+            self.histogram.record(seconds)
+        else:
+            self.errors += 1
+
+    @property
+    def requests(self):
+        return self.histogram.count + self.errors
+
+    def error_rate(self):
+        return self.errors / self.requests if self.requests else 0.0
+
+    def throughput(self, now=None):
+        """Successful requests per minute since the first request."""
+        if self.first_at is None:
+            return 0.0
+        elapsed = (now or time.time()) - self.first_at
+        return self.histogram.count * 60.0 / elapsed if elapsed > 0 else 0.0
+
+
+class LatencyStats:
+    """Request latency aggregated per provider, per model and per account.
+
+    Accounts are keyed by a stable identity; ``labels`` names them in reports.
+    """
+
+    GROUPS = (("provider", "Провайдер"), ("model", "Модель"), ("account", "Аккаунт"))
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.started_at = time.time()
+        self.series = {group: {} for group, _ in self.GROUPS}
+        self.labels = {}  # account -> display label
+
+    def record(self, provider, model, account, seconds, ok=True, label=None):
+        if label is not None:
+            self.labels[account] = label
+        now = time.time()
+        for group, key in (("provider", provider), ("model", model), ("account", account)):
+            series = self.series[group].get(key)
+            if series is None:
+                series = self.series[group][key] = LatencySeries()
+            series.record(seconds, ok, now)
+
+    def rows(self, group):
+        """(key, series) pairs of a group, busiest first."""
+        return self._named_rows(group)[1]
+
+    def _named_rows(self, group):
+        # Copies first: record() adds keys on the engine thread while the GUI formats
+        series = dict(self.series[group])
+        names = display_names(series, dict(self.labels))
+        return names, sorted(series.items(), key=lambda item: -item[1].requests)
+
+    def format_report(self, limit=10):
+        """Plain-text table for the GUI panel, CLI output and log exports."""
+        now = time.time()
+        lines = []
+        for group, title in self.GROUPS:
+            names, rows = self._named_rows(group)
+            if not rows:
+                continue
+            lines.append(f"{title:<28} {'запр':>5} {'p50':>7} {'p90':>7} {'p99':>7} {'ошибки':>7} {'ок/мин':>7}")
+            for key, series in rows[:limit]:
+                hist = series.histogram
+                lines.append(
+                    f"{names[key][:28]:<28} {series.requests:>5} {_fmt(hist.percentile(50)):>7} "
+                    f"{_fmt(hist.percentile(90)):>7} {_fmt(hist.percentile(99)):>7} "
+                    f"{series.error_rate() * 100:>6.1f}% {series.throughput(now):>7.1f}"
+                )
+            if len(rows) > limit:
+                lines.append(f"... ещё {len(rows) - limit}")
+            lines.append("")
+        return "\n".join(lines).rstrip() or "Нет данных"
+
+
+def _fmt(seconds):
+    return "—" if seconds is None else f"{seconds:.2f}s"
+
+
+class RunTiming:
+    """Where the time of a run's requests went, summed over all conversations."""
+
+    KINDS = (("network", "сеть"), ("pacing", "паузы"), ("backoff", "повторы"), ("rate_limit", "лимиты"))
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.seconds = dict.fromkeys((kind for kind, _ in self.KINDS), 0.0)
+
+    def add(self, kind, seconds):
+        self.seconds[kind] += seconds
+
+    def sleeping(self):
+        return self.seconds["pacing"] + self.seconds["backoff"] + self.seconds["rate_limit"]
+
+    def __str__(self):
+        parts = " | ".join(f"{title} {self.seconds[kind]:.1f} с" for kind, title in self.KINDS)
+        return f"⏱️ Время запросов: {parts}"
@@ -0,0 +1,220 @@
+"""SQLite store for settings, accounts and run history.
+
+The database runs in WAL mode, so the GUI can read while a run appends.
+``save_config`` writes only the settings and account rows that changed since
+the last load or save.  Per-account counters are kept by key pair and survive
+restarts.  Every run gets a row in ``runs`` and one row per turn in
+``turns``.  ``record_turn`` is called on the engine thread and only buffers
+the row; ``flush`` writes the buffer in one transaction.  JSON files in the
+``save_config`` format can be imported and exported unchanged.
+"""
+
+import json
+import sqlite3
+import threading
+import time
+
+from defi_ai_core import default_config, read_config, write_config
+
+STORE_FILE = "defi_ai.db"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS settings (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS accounts (
+    position INTEGER PRIMARY KEY,
+    enabled INTEGER NOT NULL,
+    nous_key TEXT NOT NULL,
+    openrouter_key TEXT NOT NULL,
+    proxy TEXT NOT NULL,
+    prompt TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS account_stats (
+    nous_key TEXT NOT NULL,
+    openrouter_key TEXT NOT NULL,
+    usage_count INTEGER NOT NULL DEFAULT 0,
+    success_count INTEGER NOT NULL DEFAULT 0,
+    error_count INTEGER NOT NULL DEFAULT 0,
+    last_used TEXT,
+    PRIMARY KEY (nous_key, openrouter_key)
+);
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    source TEXT NOT NULL,
+    started_at REAL NOT NULL,
+    finished_at REAL,
+    accounts INTEGER NOT NULL,
+    succeeded INTEGER,
+    failed INTEGER,
+    summary TEXT
+);
+CREATE TABLE IF NOT EXISTS turns (
+    id INTEGER PRIMARY KEY,
+    run_id INTEGER REFERENCES runs(id),
+    ts REAL NOT NULL,
+    thread_id TEXT,
+    account TEXT,
+    turn INTEGER,
+    provider TEXT,
+    model TEXT,
+    status TEXT,
+    latency REAL,
+    prompt_tokens INTEGER,
+    completion_tokens INTEGER,
+    cost REAL
+);
+CREATE INDEX IF NOT EXISTS turns_run ON turns(run_id);
+"""
+
+ACCOUNT_FIELDS = ("enabled", "nous_key", "openrouter_key", "proxy", "prompt")
+TURN_FIELDS = ("run_id", "ts", "thread_id", "account", "turn", "provider", "model", "status", "latency",
+               "prompt_tokens", "completion_tokens", "cost")
+
+
+def _account_row(account):
+    return (bool(account.get("enabled", True)), account.get("nous_key", "").strip(),
+            account.get("openrouter_key", "").strip(), account.get("proxy", "").strip(),
+            account.get("prompt", "").strip())
+
+
+class ConfigStore:
+    """Settings, accounts and run history in one SQLite file."""
+
+    def __init__(self, path=STORE_FILE):
+        self.path = path
+        self.run_id = None
+        self._lock = threading.Lock()
+        self._pending_turns = []
+        self._settings = {}  # key -> JSON text as stored
+        self._accounts = []  # account rows as stored, in table order
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        with self._db:
+            self._db.executescript(SCHEMA)
+
+    def close(self):
+        self.flush()
+        with self._lock:
+            self._db.close()
+
+    def is_empty(self):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT (SELECT COUNT(*) FROM settings) + (SELECT COUNT(*) FROM accounts)").fetchone()
+        return row[0] == 0
+
+    # ---- config ----
+
+    def load_config(self):
+        """Config dict in the ``read_config`` format."""
+        with self._lock:
+            settings = self._db.execute("SELECT key, value FROM settings").fetchall()
+            accounts = self._db.execute(
+                f"SELECT {', '.join(ACCOUNT_FIELDS)} FROM accounts ORDER BY position").fetchall()
+        self._settings = dict(settings)
+        self._accounts = [(bool(row[0]),) + tuple(row[1:]) for row in accounts]
+        config = default_config()
+        config.update((key, json.loads(value)) for key, value in settings)
+        config["accounts"] = [dict(zip(ACCOUNT_FIELDS, row)) for row in self._accounts]
+        return config
+
+    def save_config(self, config):
+        """Upsert changed settings and account rows; returns how many rows were written."""
+        settings = {key: json.dumps(value, ensure_ascii=False)
+                    for key, value in config.items() if key != "accounts"}
+        changed_settings = [(key, value) for key, value in settings.items() if self._settings.get(key) != value]
+        accounts = [_account_row(account) for account in config.get("accounts", [])]
+        changed_accounts = [(position,) + row for position, row in enumerate(accounts)
+                            if position >= len(self._accounts) or self._accounts[position] != row]
+        with self._lock, self._db:
+            self._db.executemany(
+                "INSERT INTO settings (key, value) VALUES (?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = excluded.value", changed_settings)
+            self._db.executemany(
+                f"INSERT INTO accounts (position, {', '.join(ACCOUNT_FIELDS)}) VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(position) DO UPDATE SET "
+                + ", ".join(f"{field} = excluded.{field}" for field in ACCOUNT_FIELDS), changed_accounts)
+            removed = self._db.execute("DELETE FROM accounts WHERE position >= ?", (len(accounts),)).rowcount
+        self._settings.update(changed_settings)
+        self._accounts = accounts
+        return len(changed_settings) + len(changed_accounts) + removed
+
+    def import_json(self, path):
+        """Replace settings and accounts with a JSON config file; returns the config."""
+        config = read_config(path)
+        self.save_config(config)
+        return config
+
+    def export_json(self, path):
+        write_config(self.load_config(), path)
+
+    # ---- account counters ----
+
+    def apply_stats(self, accounts):
+        """Load the stored counters into ``accounts`` (core ``Account`` objects)."""
+        with self._lock:
+            stats = {(row[0], row[1]): row[2:] for row in self._db.execute(
+                "SELECT nous_key, openrouter_key, usage_count, success_count, error_count, last_used "
+                "FROM account_stats")}
+        for account in accounts:
+            row = stats.get((account.nous_key, account.openrouter_key))
+            if row is not None:
+                account.usage_count, account.success_count, account.error_count, account.last_used = row
+
+    def save_stats(self, accounts):
+        rows = [(account.nous_key, account.openrouter_key, account.usage_count, account.success_count,
+                 account.error_count, account.last_used) for account in accounts]
+        with self._lock, self._db:
+            self._db.executemany(
+                "INSERT INTO account_stats VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(nous_key, openrouter_key) DO UPDATE SET usage_count = excluded.usage_count, "
+                "success_count = excluded.success_count, error_count = excluded.error_count, "
+                "last_used = excluded.last_used", rows)
+
+    # ---- run history ----
+
+    def begin_run(self, source, accounts):
+        """Open a run record; turns recorded from now on belong to it."""
+        self.flush()
+        with self._lock, self._db:
+            self.run_id = self._db.execute("INSERT INTO runs (source, started_at, accounts) VALUES (?, ?, ?)",
+                                           (source, time.time(), accounts)).lastrowid
+        return self.run_id
+
+    def record_turn(self, **fields):
+        """Buffer one turn of the current run; safe from any thread."""
+        fields.setdefault("ts", time.time())
+        fields["run_id"] = self.run_id
+        row = tuple(fields.get(field) for field in TURN_FIELDS)
+        with self._lock:
+            self._pending_turns.append(row)
+
+    def flush(self):
+        with self._lock:
+            rows, self._pending_turns = self._pending_turns, []
+            if rows:
+                with self._db:
+                    self._db.executemany(
+                        f"INSERT INTO turns ({', '.join(TURN_FIELDS)}) "
+                        f"VALUES ({', '.join('?' * len(TURN_FIELDS))})", rows)
+
+    def finish_run(self, succeeded, failed, summary=None):
+        self.flush()
+        if self.run_id is None:
+            return
+        with self._lock, self._db:
+            self._db.execute("UPDATE runs SET finished_at = ?, succeeded = ?, failed = ?, summary = ? WHERE id = ?",
+                             (time.time(), succeeded, failed,
+                              json.dumps(summary, ensure_ascii=False) if summary is not None else None,
+                              self.run_id))
+
+
+def open_config(path):
+    """(config, store) for ``path``: a ``.db`` store, or (config, None) for a JSON file."""
+    if path.endswith(".db"):
+        store = ConfigStore(path)
+        return store.load_config(), store
+    return read_config(path), None
@@ -0,0 +1,191 @@
+"""Span tracing and profiling of a run.
+
+``Tracer`` records spans of each conversation's turns: queue wait, pacing,
+rate-limit wait, connect, time to first byte, body read, parse, backoff and
+event emission.  ``export`` writes them as a Chrome trace, which
+chrome://tracing and ui.perfetto.dev open with one track per conversation.
+A disabled tracer returns from ``add`` straight away, and ``wrap`` then
+hands back the original callable.
+
+``RunProfiler`` runs ``cProfile`` on the engine thread for the length of a
+run and/or compares ``tracemalloc`` snapshots taken at its start and end.
+Neither ever waits on the engine thread: the profile is switched on and off
+by calls queued to its loop, and the files are written once the switch-off
+has run there.
+"""
+
+import concurrent.futures
+import cProfile
+import json
+import os
+import time
+import tracemalloc
+
+TRACE_DIR = "defi_ai_traces"
+DEFAULT_MAX_EVENTS = 500_000
+MEMORY_FRAMES = 10
+MEMORY_TOP = 30
+
+
+class Tracer:
+    """Spans as (name, track, start, duration, args); tracks are conversation thread ids."""
+
+    def __init__(self, enabled=False, max_events=DEFAULT_MAX_EVENTS):
+        self.enabled = enabled
+        self.max_events = max_events
+        self.reset()
+
+    def reset(self):
+        self.origin = time.monotonic()
+        self.events = []
+        self.dropped = 0
+
+    def add(self, name, track, start, end=None, **args):
+        """Record a span that began at ``start`` (time.monotonic) and ends at ``end`` or now."""
+        if not self.enabled:
+            return
+        if len(self.events) >= self.max_events:
+            self.dropped += 1
+            return
+        if end is None:
+            end = time.monotonic()
+        self.events.append((name, track, start, end - start, args))
+
+    def wrap(self, name, track, fn):
+        """``fn`` with every call recorded as a span; ``fn`` itself while disabled."""
+        if not self.enabled:
+            return fn
+
+        def traced(*args):
+            start = time.monotonic()
+            try:
+                return fn(*args)
+            finally:
+                self.add(name, track, start)
+
+        return traced
+
+    def chrome_trace(self):
+        """Trace Event Format dict with complete ("X") events in microseconds."""
+        events = list(self.events)
+        tids = {}
+        trace_events = [{"name": "process_name", "ph": "M", "pid": 1, "tid": 0,
+                         "args": {"name": "DeFi AI Club"}}]
+        for name, track, start, duration, args in events:
+            tid = tids.get(track)
+            if tid is None:
+                tid = tids[track] = len(tids) + 1
+                trace_events.append({"name": "thread_name", "ph": "M", "pid": 1, "tid": tid,
+                                     "args": {"name": str(track)}})
+            trace_events.append({"name": name, "cat": "engine", "ph": "X", "pid": 1, "tid": tid,
+                                 "ts": round((start - self.origin) * 1e6, 1),
+                                 "dur": round(duration * 1e6, 1), "args": args})
+        return {"traceEvents": trace_events, "displayTimeUnit": "ms",
+                "otherData": {"dropped_events": self.dropped}}
+
+    def export(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.chrome_trace(), f, ensure_ascii=False)
+        return len(self.events)
+
+
+class RunProfiler:
+    """cProfile of the engine thread and a tracemalloc diff over one run."""
+
+    def __init__(self, cpu=False, memory=False):
+        self.cpu = cpu
+        self.memory = memory
+        self.profile = None
+        self._baseline = None
+        self._started_tracemalloc = False
+
+    @property
+    def enabled(self):
+        return self.cpu or self.memory
+
+    def start(self, call_on_loop):
+        """``call_on_loop(fn)`` queues ``fn`` to the engine thread and returns a future.
+
+        Returns at once; the profile is on before anything queued after this call runs.
+        """
+        if self.memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(MEMORY_FRAMES)
+                self._started_tracemalloc = True
+            self._baseline = tracemalloc.take_snapshot()
+        if self.cpu:
+            self.profile = cProfile.Profile()
+            call_on_loop(self.profile.enable)
+
+    def stop(self, call_on_loop, prefix):
+        """Future of the paths written (``prefix``.pstats, ``prefix``-memory.txt).
+
+        Returns at once; the files are written on the engine thread after the
+        profile was switched off there.
+        """
+        if self.profile is None:
+            return _resolved(self._write, prefix)
+        result = concurrent.futures.Future()
+        call_on_loop(self.profile.disable).add_done_callback(lambda _: _complete(result, self._write, prefix))
+        return result
+
+    def _write(self, prefix):
+        paths = []
+        if self.profile is not None:
+            self.profile.dump_stats(prefix + ".pstats")
+            paths.append(prefix + ".pstats")
+            self.profile = None
+        if self._baseline is not None:
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            if self._started_tracemalloc:
+                tracemalloc.stop()
+                self._started_tracemalloc = False
+            with open(prefix + "-memory.txt", "w", encoding="utf-8") as f:
+                f.write(f"current {current / 1024:.1f} KiB, peak {peak / 1024:.1f} KiB\n\n")
+                for stat in snapshot.compare_to(self._baseline, "lineno")[:MEMORY_TOP]:
+                    f.write(f"{stat}\n")
+            paths.append(prefix + "-memory.txt")
+            self._baseline = None
+        return paths
+
+
+def _complete(future, fn, *args):
+    try:
+        future.set_result(fn(*args))
+    except Exception as e:
+        future.set_exception(e)
+
+
+def _resolved(fn, *args):
+    future = concurrent.futures.Future()
+    _complete(future, fn, *args)
+    return future
+
+
+def trace_prefix(directory=TRACE_DIR):
+    """``directory``/run-<local time>, creating the directory."""
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, time.strftime("run-%Y%m%d-%H%M%S"))
+
+
+def write_run_trace(tracer, profiler, call_on_loop, directory=TRACE_DIR):
+    """Stop the profiler and export the spans into ``directory``; never blocks.
+
+    Returns a concurrent.futures.Future of the paths written.  It resolves on
+    the engine thread, or at once when there is nothing to wait for.
+    """
+    if not tracer.enabled and not profiler.enabled:
+        return _resolved(list)
+    prefix = trace_prefix(directory)
+    result = concurrent.futures.Future()
+
+    def export(profiled):
+        paths = []
+        if tracer.enabled:
+            tracer.export(prefix + ".trace.json")
+            paths.append(prefix + ".trace.json")
+        return paths + profiled.result()
+
+    profiler.stop(call_on_loop, prefix).add_done_callback(lambda profiled: _complete(result, export, profiled))
+    return result
@@ -0,0 +1,151 @@
+"""Append-only JSONL transcript of every conversation turn.
+
+``TranscriptStore.record`` only enqueues; a dedicated writer thread owns the
+file, buffers writes, rotates it once it reaches ``max_bytes`` and optionally
+gzips the rotated part.  Readers stream records back with filters, one line
+at a time, so exports never hold a whole run in memory.
+"""
+
+import gzip
+import json
+import os
+import queue
+import shutil
+import threading
+import time
+
+TRANSCRIPT_DIR = "defi_ai_transcripts"
+CURRENT_NAME = "transcript.jsonl"
+DEFAULT_MAX_BYTES = 10 * 1024 * 1024
+ROTATED_PREFIX = "transcript-"
+
+_STOP = object()
+
+
+class TranscriptStore:
+    """Buffered, rotating JSONL store written from a background thread."""
+
+    def __init__(self, directory=TRANSCRIPT_DIR, max_bytes=DEFAULT_MAX_BYTES, compress=False,
+                 flush_interval=1.0):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.compress = compress
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    @property
+    def current_path(self):
+        return os.path.join(self.directory, CURRENT_NAME)
+
+    def record(self, **fields):
+        """Queue one turn; ``ts`` (epoch seconds) is added if missing."""
+        fields.setdefault("ts", time.time())
+        self._ensure_writer()
+        self._queue.put(fields)
+
+    def _ensure_writer(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="TranscriptWriter", daemon=True)
+                self._thread.start()
+
+    def flush(self, timeout=5):
+        """Block until everything queued so far is on disk."""
+        if self._thread is None or not self._thread.is_alive():
+            return
+        done = threading.Event()
+        self._queue.put(done)
+        done.wait(timeout)
+
+    def close(self, timeout=5):
+        if self._thread is None or not self._thread.is_alive():
+            return
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+
+    # ---- writer thread ----
+
+    def _run(self):
+        os.makedirs(self.directory, exist_ok=True)
+        f = open(self.current_path, "a", encoding="utf-8", buffering=64 * 1024)
+        size = f.tell()
+        try:
+            while True:
+                try:
+                    item = self._queue.get(timeout=self.flush_interval)
+                except queue.Empty:
+                    f.flush()
+                    continue
+                if item is _STOP:
+                    break
+                if isinstance(item, threading.Event):
+                    f.flush()
+                    item.set()
+                    continue
+                line = json.dumps(item, ensure_ascii=False) + "\n"
+                f.write(line)
+                size += len(line.encode("utf-8"))
+                if size >= self.max_bytes:
+                    f.close()
+                    self._rotate()
+                    f = open(self.current_path, "a", encoding="utf-8", buffering=64 * 1024)
+                    size = 0
+        finally:
+            f.close()
+
+    def _rotate(self):
+        stamp = f"{time.strftime('%Y%m%d-%H%M%S')}-{time.time_ns() % 10**9:09d}"
+        rotated = os.path.join(self.directory, f"{ROTATED_PREFIX}{stamp}.jsonl")
+        os.replace(self.current_path, rotated)
+        if self.compress:
+            with open(rotated, "rb") as src, gzip.open(rotated + ".gz", "wb") as dst:
+                shutil.copyfileobj(src, dst)
+            os.remove(rotated)
+
+    # ---- readers ----
+
+    def files(self):
+        """Transcript files oldest first: rotated parts, then the current one."""
+        if not os.path.isdir(self.directory):
+            return []
+        rotated = sorted(name for name in os.listdir(self.directory) if name.startswith(ROTATED_PREFIX))
+        paths = [os.path.join(self.directory, name) for name in rotated]
+        if os.path.exists(self.current_path):
+            paths.append(self.current_path)
+        return paths
+
+    def iter_records(self, since=None, until=None, provider=None, status=None):
+        """Stream records matching the filters; times are epoch seconds."""
+        self.flush()
+        for path in self.files():
+            if since is not None and path != self.current_path and os.path.getmtime(path) < since:
+                continue  # rotated parts are never written again
+            opener = gzip.open if path.endswith(".gz") else open
+            with opener(path, "rt", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        rec = json.loads(line)
+                    except ValueError:
+                        continue  # torn last line after a crash
+                    ts = rec.get("ts", 0)
+                    if since is not None and ts < since:
+                        continue
+                    if until is not None and ts > until:
+                        continue
+                    if provider and rec.get("provider") != provider:
+                        continue
+                    if status and rec.get("status") != status:
+                        continue
+                    yield rec
+
+    def export(self, destination, **filters):
+        """Write matching records to ``destination`` as JSONL; returns the count."""
+        count = 0
+        opener = gzip.open if destination.endswith(".gz") else open
+        with opener(destination, "wt", encoding="utf-8") as out:
+            for rec in self.iter_records(**filters):
+                out.write(json.dumps(rec, ensure_ascii=False) + "\n")
+                count += 1
+        return count
@@ -0,0 +1,147 @@
+"""Token usage and cost accounting with optional budget caps.
+
+``UsageLedger`` is fed with the ``usage`` block of every successful reply
+(prompt and completion tokens) and prices it with a per-model table in USD
+per million tokens.  Totals are kept per run, per account, per provider and
+per model.  Caps on tokens or money, per run and per account, are checked
+by the engine before it schedules a conversation or starts a new turn.
+All updates happen on the engine thread; readers only format snapshots.
+
+Accounts are keyed by a stable identity (the engine passes the key pair);
+their short labels are only used when a report or summary is formatted.
+"""
+
+from defi_ai_stats import display_names
+
+# USD per 1M tokens: (prompt, completion).  List prices at the time of
+# writing; override them with the "prices" config setting.
+DEFAULT_PRICES = {
+    "Hermes-4-70B": (0.13, 0.40),
+    "openai/gpt-3.5-turbo": (0.50, 1.50),
+}
+
+
+class UsageTotals:
+    """Tokens and cost summed over some set of requests."""
+
+    __slots__ = ("requests", "prompt_tokens", "completion_tokens", "cost")
+
+    def __init__(self):
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cost = 0.0
+
+    @property
+    def tokens(self):
+        return self.prompt_tokens + self.completion_tokens
+
+    def add(self, prompt_tokens, completion_tokens, cost):
+        self.requests += 1
+        self.prompt_tokens += prompt_tokens
+        self.completion_tokens += completion_tokens
+        self.cost += cost
+
+    def as_dict(self):
+        return {"requests": self.requests, "prompt_tokens": self.prompt_tokens,
+                "completion_tokens": self.completion_tokens, "cost_usd": round(self.cost, 6)}
+
+    def __str__(self):
+        return (f"вход {self.prompt_tokens} / выход {self.completion_tokens} ток., "
+                f"${self.cost:.4f}")
+
+
+class UsageLedger:
+    """Per-run usage totals, the price table and the budget caps."""
+
+    GROUPS = (("provider", "Провайдер"), ("model", "Модель"), ("account", "Аккаунт"))
+
+    def __init__(self, prices=None):
+        self.prices = dict(DEFAULT_PRICES)
+        if prices:
+            self.set_prices(prices)
+        # 0 = no cap
+        self.max_run_tokens = 0
+        self.max_run_cost = 0.0
+        self.max_account_tokens = 0
+        self.max_account_cost = 0.0
+        self.reset()
+
+    def reset(self):
+        self.total = UsageTotals()
+        self.groups = {group: {} for group, _ in self.GROUPS}
+        self.labels = {}  # account -> display label
+
+    def set_prices(self, prices):
+        """``prices``: model -> [prompt, completion] USD per 1M tokens."""
+        for model, (prompt_price, completion_price) in prices.items():
+            self.prices[model] = (float(prompt_price), float(completion_price))
+
+    def configure_caps(self, run_tokens=None, run_cost=None, account_tokens=None, account_cost=None):
+        if run_tokens is not None:
+            self.max_run_tokens = max(0, int(run_tokens))
+        if run_cost is not None:
+            self.max_run_cost = max(0.0, float(run_cost))
+        if account_tokens is not None:
+            self.max_account_tokens = max(0, int(account_tokens))
+        if account_cost is not None:
+            self.max_account_cost = max(0.0, float(account_cost))
+
+    def cost(self, model, prompt_tokens, completion_tokens):
+        prompt_price, completion_price = self.prices.get(model, (0.0, 0.0))
+        return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1_000_000
+
+    def record(self, provider, model, account, prompt_tokens, completion_tokens, label=None):
+        """Add one reply; returns its cost in USD."""
+        if label is not None:
+            self.labels[account] = label
+        cost = self.cost(model, prompt_tokens, completion_tokens)
+        self.total.add(prompt_tokens, completion_tokens, cost)
+        for group, key in (("provider", provider), ("model", model), ("account", account)):
+            totals = self.groups[group].get(key)
+            if totals is None:
+                totals = self.groups[group][key] = UsageTotals()
+            totals.add(prompt_tokens, completion_tokens, cost)
+        return cost
+
+    def cap_reached(self, account=None):
+        """Why no new turn may start (run cap first, then ``account``'s), or None."""
+        total = self.total
+        if self.max_run_tokens and total.tokens >= self.max_run_tokens:
+            return f"лимит токенов на запуск ({self.max_run_tokens})"
+        if self.max_run_cost and total.cost >= self.max_run_cost:
+            return f"лимит стоимости на запуск (${self.max_run_cost:.2f})"
+        totals = self.groups["account"].get(account)
+        if totals is not None:
+            if self.max_account_tokens and totals.tokens >= self.max_account_tokens:
+                return f"лимит токенов на аккаунт ({self.max_account_tokens})"
+            if self.max_account_cost and totals.cost >= self.max_account_cost:
+                return f"лимит стоимости на аккаунт (${self.max_account_cost:.2f})"
+        return None
+
+    def _named_rows(self, group):
+        # Copies first: record() adds keys on the engine thread while the GUI formats
+        totals = dict(self.groups[group])
+        return display_names(totals, dict(self.labels)), list(totals.items())
+
+    def summary(self):
+        """Nested dict for JSON run records."""
+        result = {"total": self.total.as_dict()}
+        for group, _ in self.GROUPS:
+            names, rows = self._named_rows(group)
+            result[group] = {names[key]: totals.as_dict() for key, totals in rows}
+        return result
+
+    def format_report(self, limit=10):
+        lines = [f"💰 Всего: {self.total}"]
+        for group, title in self.GROUPS:
+            names, rows = self._named_rows(group)
+            rows = sorted(rows, key=lambda item: -item[1].cost)
+            for key, totals in rows[:limit]:
+                lines.append(f"  {title} {names[key]}: {totals}")
+            if len(rows) > limit:
+                lines.append(f"  ... ещё {len(rows) - limit}")
+        return "\n".join(lines)
+
+    def __str__(self):
+        return f"💰 Токены: {self.total}"
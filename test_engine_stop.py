@@ -0,0 +1,120 @@
+"""stop_all() against the bench mock: never blocks, cancels within STOP_TIMEOUT.
+
+Run with ``python -m pytest test_engine_stop.py`` (needs aiohttp).
+"""
+
+import argparse
+import time
+import unittest
+
+from defi_ai_bench import MOCK_PATHS, start_mock
+from defi_ai_breaker import DEFAULT_MIN_REQUESTS
+from defi_ai_core import Account
+from defi_ai_engine import CANCELLED, STOP_TIMEOUT, ConversationEngine
+
+CONCURRENCY = 4
+CONVERSATIONS = 10
+# name -> (latency, errors); "hanging" answers far later than the test may take,
+# so only cancellation can end a request
+MOCKS = {"hanging": ("fixed:30", ""), "fast": ("fixed:0", ""), "failing": ("fixed:0", "500=1.0")}
+# Pacing and backoff sleeps far longer than the test may take
+LONG_SLEEP = 20
+# stop_all() only schedules the cancellation on the engine thread
+STOP_CALL_BOUND = 0.05
+
+
+class EngineStopTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.mocks = {}
+        for name, (latency, errors) in MOCKS.items():
+            args = argparse.Namespace(latency=latency, errors=errors, response_words=20, token_delay=0.0,
+                                      hang_seconds=30.0)
+            cls.mocks[name] = start_mock(args)
+
+    @classmethod
+    def tearDownClass(cls):
+        # The hanging mock is still sleeping in its handlers; no graceful shutdown
+        for process, _ in cls.mocks.values():
+            process.kill()
+            process.wait(5)
+
+    def setUp(self):
+        self.engine = ConversationEngine(CONCURRENCY)
+        self.engine.request_timeout = 60
+
+    def use_mock(self, name):
+        base_url = self.mocks[name][1]
+        self.engine.endpoints = {"nousresearch": base_url + MOCK_PATHS[0],
+                                 "openrouter": base_url + MOCK_PATHS[1]}
+
+    def tearDown(self):
+        self.engine.shutdown()
+
+    def submit_all(self, delay_range=(0, 0)):
+        accounts = [Account(f"test-nous-{i}", f"test-or-{i}", "", "test prompt") for i in range(CONVERSATIONS)]
+        return {f"Test-{i}": self.engine.submit(account, 3, f"Test-{i}", delay_range)
+                for i, account in enumerate(accounts)}
+
+    def wait_running(self, count, timeout=5):
+        self.wait_until(lambda: self.engine.active_count() >= count, timeout, "conversations did not start")
+
+    def wait_until(self, condition, timeout, message):
+        deadline = time.monotonic() + timeout
+        while not condition():
+            self.assertLess(time.monotonic(), deadline, message)
+            time.sleep(0.01)
+
+    def requests_sent(self):
+        return sum(dict(self.engine.metrics.requests).values())
+
+    def assert_stops(self, futures):
+        conversations = {thread_id: self.engine.conversations[thread_id] for thread_id in futures}
+        started = time.monotonic()
+        drained = self.engine.stop_all()
+        self.assertLess(time.monotonic() - started, STOP_CALL_BOUND)
+
+        seconds, still_running = drained.result(STOP_TIMEOUT + 1)
+        self.assertEqual(still_running, 0)
+        self.assertLess(seconds, STOP_TIMEOUT)
+        for thread_id, future in futures.items():
+            self.assertIs(future.result(1), False)
+            self.assertEqual(conversations[thread_id].state, CANCELLED, thread_id)
+        self.assertEqual(self.engine.state_counts[CANCELLED], CONVERSATIONS)
+        self.assertEqual(self.engine.active_count() + self.engine.queued_count(), 0)
+
+    def test_stop_cancels_in_flight_requests(self):
+        self.use_mock("hanging")
+        futures = self.submit_all()
+        self.wait_running(CONCURRENCY)
+        self.assertEqual(self.engine.queued_count(), CONVERSATIONS - CONCURRENCY)
+        self.assert_stops(futures)
+
+    def test_stop_cancels_pacing_delays(self):
+        # The first request goes out at once and is answered at once; the next one is paced
+        self.use_mock("fast")
+        futures = self.submit_all(delay_range=(LONG_SLEEP, LONG_SLEEP))
+        self.wait_until(lambda: sum(dict(self.engine.metrics.turns).values()) >= CONCURRENCY, 5,
+                        "first turns did not finish")
+        # Let the workers get from the finished turn into Pacer.wait()
+        time.sleep(0.2)
+        self.assert_stops(futures)
+        self.assertEqual(self.requests_sent(), CONCURRENCY)
+
+    def test_stop_cancels_retry_backoff(self):
+        # Below the breaker's minimum sample, so every failure backs off instead of tripping it
+        self.assertLess(CONCURRENCY, DEFAULT_MIN_REQUESTS)
+        self.use_mock("failing")
+        policy = {"backoff_base": LONG_SLEEP, "jitter": 0}
+        self.engine.configure_retries(3, 0, {"nousresearch": policy, "openrouter": policy})
+        futures = self.submit_all()
+        # metrics.retry() is counted right before the backoff sleep starts
+        self.wait_until(lambda: sum(dict(self.engine.metrics.retries).values()) >= CONCURRENCY, 5,
+                        "requests did not back off")
+        self.assert_stops(futures)
+        self.assertEqual(self.requests_sent(), CONCURRENCY)
+
+
+if __name__ == "__main__":
+    unittest.main()